@@ -80,6 +80,10 @@ DATABASES = {
     }
 }
 
+# The tables of the original Access database are created in the test database before
+# its migrations are run, as import_access_db creates them before migrate
+TEST_RUNNER = 'schools.test_runner.LegacyTablesTestRunner'
+
 # Munigeo
 # https://github.com/City-of-Helsinki/munigeo
 
@@ -129,6 +133,23 @@ REST_FRAMEWORK = {
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+# Serve the school endpoint from the stored school documents, which are kept
+# up to date on saves. Run the rebuild_school_documents command after enabling
+# this and after loading the kore database from outside Django.
+SCHOOL_DOCUMENT_STORE = False
+
+# Use a cache shared by all processes, such as memcached, in production
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds the rendered API responses are cached. Responses outdated by saves are
+# served once more while they are rendered again in the background.
+API_CACHE_TIMEOUT = 24 * 60 * 60
+
 # local_settings.py can be used to override environment-specific settings
 # like database and email that differ between development and production.
 try:
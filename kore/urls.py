@@ -2,8 +2,11 @@ from django.conf.urls import include, url
 from django.contrib import admin
 
 from schools.api import router
+from schools.views import IndexedAutocompleteLookup
 
 urlpatterns = [
+    # overrides the autocomplete lookup of grappelli
+    url(r'^grappelli/lookup/autocomplete/$', IndexedAutocompleteLookup.as_view(), name="grp_autocomplete_lookup"),
     url(r'^grappelli/', include('grappelli.urls')),
     url(r'^admin/', include(admin.site.urls)),
     url(r'v1/', include(router.urls)),
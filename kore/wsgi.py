@@ -12,3 +12,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kore.settings")
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# the autocomplete of the admin answers from indexes kept in memory
+from schools.autocomplete import build_indexes
+build_indexes()
@@ -0,0 +1,299 @@
+"""
+Loads the original Access database of kore into PostgreSQL with the mdbtools
+command line tools.
+
+Each table is streamed from the CSV output of mdb-export into COPY, without
+building INSERT statements. COPY parses the 1 and 0 written by mdb-export for
+boolean columns, so the columns are created as booleans from the start.
+
+The hash of every imported row is recorded in SourceRowHash. Later versions of
+the database are synced by copying each table to a temporary staging table and
+comparing the hashes of its rows to the recorded ones, so that only the rows
+changed are written, in one statement per table and kind of change.
+"""
+import csv
+import subprocess
+
+from django.db import connection, transaction
+
+from .models import SourceRowHash
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# the columns identifying the rows of the tables whose primary key is replaced on import
+SOURCE_KEYS = {
+    'Rakennuksen_status': ('koulun_id', 'rakennuksen_id'),
+}
+
+# the columns added on import that are computed from the source columns
+DERIVED_COLUMNS = {
+    'Rakennuksen_status': {'id': "koulun_id || '-' || rakennuksen_id"},
+}
+
+
+def _run(*args):
+    return subprocess.check_output(args, universal_newlines=True)
+
+
+def list_tables(path):
+    return [table for table in _run('mdb-tables', '-1', path).splitlines() if table]
+
+
+def read_schema(path):
+    """
+    Returns the statements creating the tables, and those creating their constraints and
+    indexes, which are only run once the data is loaded.
+    """
+    tables, constraints = [], []
+    for line in _run('mdb-schema', path, 'postgres').splitlines():
+        if 'CONSTRAINT' in line or 'INDEX' in line:
+            constraints.append(line)
+        else:
+            tables.append(line)
+    return '\n'.join(tables), '\n'.join(constraints)
+
+
+def _export(path, table):
+    """
+    Starts mdb-export on the table. Returns the process and the columns of the table, read from
+    the header of the output.
+    """
+    process = subprocess.Popen(['mdb-export', '-b', 'strip', '-D', DATE_FORMAT, path, table], stdout=subprocess.PIPE)
+    return process, next(csv.reader([process.stdout.readline().decode('utf-8')]))
+
+
+def read_columns(path, table):
+    """
+    Returns the columns of the Access table, without reading its rows.
+    """
+    process, columns = _export(path, table)
+    process.stdout.close()
+    process.wait()
+    return columns
+
+
+def copy_table(path, table, target=None):
+    """
+    Copies the rows of the Access table to the PostgreSQL table of the same name, or to ``target``.
+    Returns the columns of the Access table and the number of rows.
+    """
+    qn = connection.ops.quote_name
+    process, columns = _export(path, table)
+    try:
+        sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+            qn(target or table), ', '.join(qn(column) for column in columns))
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, process.stdout)
+            rows = cursor.rowcount
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, 'mdb-export')
+    return columns, rows
+
+
+def create_fake_primary_keys(tables):
+    """
+    Adds the id columns Django expects to those of the loaded tables with a primary key of
+    another name, in one transaction. Returns the names of the tables changed.
+    """
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT t.table_name FROM information_schema.tables t "
+            "WHERE t.table_schema = current_schema() AND t.table_name = ANY(%s) "
+            "AND NOT EXISTS (SELECT 1 FROM information_schema.columns c WHERE c.table_schema = t.table_schema "
+            "AND c.table_name = t.table_name AND c.column_name = 'id') "
+            "AND (t.table_name = 'Rakennuksen_status' OR EXISTS (SELECT 1 FROM information_schema.table_constraints c "
+            "WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name "
+            "AND c.constraint_type = 'PRIMARY KEY'))", [list(tables)])
+        tables = [row[0] for row in cursor.fetchall()]
+        statements = []
+        for table in tables:
+            if table == 'Rakennuksen_status':
+                # the school buildings are identified by the school and the building
+                statements += [
+                    'ALTER TABLE %s ADD COLUMN id varchar' % qn(table),
+                    'UPDATE %s SET id = %s' % (qn(table), DERIVED_COLUMNS[table]['id']),
+                    'ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s, ADD PRIMARY KEY (id)' % (
+                        qn(table), qn(table + '_pkey')),
+                ]
+            else:
+                statements.append('ALTER TABLE %s ADD COLUMN id serial' % qn(table))
+        for statement in statements:
+            cursor.execute(statement)
+    return tables
+
+
+def table_order(tables):
+    """
+    Returns the tables ordered so that each table comes after the tables its foreign keys refer to.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, p.relname FROM pg_constraint k "
+            "JOIN pg_class c ON c.oid = k.conrelid JOIN pg_class p ON p.oid = k.confrelid "
+            "WHERE k.contype = 'f' AND c.relname = ANY(%s) AND p.relname = ANY(%s) AND c.relname <> p.relname",
+            [list(tables), list(tables)])
+        references = {}
+        for table, referenced in cursor.fetchall():
+            references.setdefault(table, set()).add(referenced)
+    ordered, remaining = [], list(tables)
+    while remaining:
+        ready = [table for table in remaining if not references.get(table, set()) - set(ordered)]
+        # tables referring to each other are taken in the given order
+        ordered.extend(ready or remaining[:1])
+        remaining = [table for table in remaining if table not in ordered]
+    return ordered
+
+
+def source_key(table, columns):
+    """
+    Returns the columns identifying the rows of the table, or None if the rows cannot be told apart.
+    """
+    if table in SOURCE_KEYS:
+        return SOURCE_KEYS[table]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = %s::regclass AND i.indisprimary ORDER BY a.attnum",
+            [connection.ops.quote_name(table)])
+        key = tuple(row[0] for row in cursor.fetchall())
+    if not key or not set(key) <= set(columns):
+        return None
+    return key
+
+
+def _row_sql(alias, columns):
+    return 'ROW(%s)::text' % ', '.join('%s.%s' % (alias, connection.ops.quote_name(column)) for column in columns)
+
+
+def record_row_hashes(table, columns):
+    """
+    Records the hashes of all rows of an imported table. Returns False if the rows cannot be told apart.
+    """
+    key = source_key(table, columns)
+    if key is None:
+        return False
+    qn = connection.ops.quote_name
+    SourceRowHash.objects.filter(table_name=table).delete()
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {hashes} (table_name, row_key, row_hash) '
+                       'SELECT %s, {key}, md5({row}) FROM {table} t'.format(
+                           hashes=qn(SourceRowHash._meta.db_table), key=_row_sql('t', key),
+                           row=_row_sql('t', columns), table=qn(table)), [table])
+    return True
+
+
+class TableSync(object):
+    """
+    The changes to a table in a new version of the Access database, found by comparing the hashes
+    of its rows to those recorded. Runs in the transaction of the sync, as the staging tables are
+    dropped on commit.
+    """
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+        qn = connection.ops.quote_name
+        self.quoted = qn(table)
+        self.staging = qn('sync_' + table)
+        self.changes = qn('sync_changes_' + table)
+        self.hashes = qn(SourceRowHash._meta.db_table)
+        self.columns = self.key = None
+        self.upserted = self.deleted = 0
+
+    def stage(self):
+        """
+        Copies the table to the staging table and finds the changed rows. Returns False if the
+        rows cannot be told apart.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT * FROM {table} WITH NO DATA'
+                           .format(staging=self.staging, table=self.quoted))
+            self.columns = copy_table(self.path, self.table, 'sync_' + self.table)[0]
+            self.key = source_key(self.table, self.columns)
+            if self.key is None:
+                return False
+            cursor.execute('ALTER TABLE {staging} ADD COLUMN sync_key text, ADD COLUMN sync_hash text; '
+                           'UPDATE {staging} s SET sync_key = {key}, sync_hash = md5({row})'.format(
+                               staging=self.staging, key=_row_sql('s', self.key), row=_row_sql('s', self.columns)))
+            cursor.execute(
+                "CREATE TEMPORARY TABLE {changes} ON COMMIT DROP AS "
+                "SELECT coalesce(s.sync_key, h.row_key) AS row_key, "
+                "CASE WHEN s.sync_key IS NULL THEN 'delete' ELSE 'upsert' END AS change "
+                "FROM {staging} s FULL JOIN (SELECT row_key, row_hash FROM {hashes} WHERE table_name = %s) h "
+                "ON h.row_key = s.sync_key WHERE s.sync_hash IS DISTINCT FROM h.row_hash".format(
+                    changes=self.changes, staging=self.staging, hashes=self.hashes), [self.table])
+            cursor.execute("SELECT count(*) FILTER (WHERE change = 'upsert'), count(*) FILTER (WHERE change = 'delete') "
+                           "FROM {changes}".format(changes=self.changes))
+            self.upserted, self.deleted = cursor.fetchone()
+        return True
+
+    def _changed(self, change):
+        return "(SELECT row_key FROM {changes} WHERE change = '{change}')".format(changes=self.changes, change=change)
+
+    def _key_join(self):
+        qn = connection.ops.quote_name
+        return ' AND '.join('t.{column} = s.{column}'.format(column=qn(column)) for column in self.key)
+
+    def upsert(self, pk_column=None):
+        """
+        Updates the changed rows and inserts the new ones. Returns the values of ``pk_column`` of the rows.
+        """
+        if not self.upserted:
+            return []
+        qn = connection.ops.quote_name
+        values = [column for column in self.columns if column not in self.key]
+        derived = DERIVED_COLUMNS.get(self.table, {})
+        with connection.cursor() as cursor:
+            if values:
+                cursor.execute('UPDATE {table} t SET {values} FROM {staging} s WHERE {join} AND s.sync_key IN {changed}'
+                               .format(table=self.quoted, staging=self.staging, join=self._key_join(),
+                                       changed=self._changed('upsert'),
+                                       values=', '.join('{0} = s.{0}'.format(qn(column)) for column in values)))
+            cursor.execute('INSERT INTO {table} ({columns}) SELECT {values} FROM {staging} s '
+                           'WHERE s.sync_key IN {changed} AND NOT EXISTS (SELECT 1 FROM {table} t WHERE {join})'
+                           .format(table=self.quoted, staging=self.staging, join=self._key_join(),
+                                   changed=self._changed('upsert'),
+                                   columns=', '.join(qn(column) for column in self.columns + list(derived)),
+                                   values=', '.join(['s.' + qn(column) for column in self.columns] +
+                                                    list(derived.values()))))
+            if pk_column is None:
+                return []
+            cursor.execute('SELECT t.{pk} FROM {table} t JOIN {staging} s ON {join} WHERE s.sync_key IN {changed}'
+                           .format(pk=qn(pk_column), table=self.quoted, staging=self.staging,
+                                   join=self._key_join(), changed=self._changed('upsert')))
+            return [row[0] for row in cursor.fetchall()]
+
+    def deleted_pks(self, pk_column):
+        """
+        Returns the values of ``pk_column`` of the rows deleted from the Access database.
+        """
+        if not self.deleted:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT t.{pk} FROM {table} t WHERE {key} IN {changed}'.format(
+                pk=connection.ops.quote_name(pk_column), table=self.quoted,
+                key=_row_sql('t', self.key), changed=self._changed('delete')))
+            return [row[0] for row in cursor.fetchall()]
+
+    def delete(self):
+        if self.deleted:
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM {table} t WHERE {key} IN {changed}'.format(
+                    table=self.quoted, key=_row_sql('t', self.key), changed=self._changed('delete')))
+
+    def record(self):
+        """
+        Replaces the hashes of the changed rows with those of the staged rows.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {hashes} WHERE table_name = %s AND row_key IN (SELECT row_key FROM {changes})'
+                           .format(hashes=self.hashes, changes=self.changes), [self.table])
+            cursor.execute('INSERT INTO {hashes} (table_name, row_key, row_hash) '
+                           'SELECT %s, sync_key, sync_hash FROM {staging} WHERE sync_key IN {changed}'
+                           .format(hashes=self.hashes, staging=self.staging, changed=self._changed('upsert')),
+                           [self.table])
@@ -1,7 +1,13 @@
 from django.contrib import admin
 from django.contrib.gis import admin as geo_admin
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, models
+from django.db.models import Q
 import nested_admin
 from .models import *
+from .search import matching_schools
+from .signals import delete_in_bulk, notify_changed
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -21,6 +27,161 @@ class KoreAdmin(nested_admin.NestedModelAdmin):
     def has_add_permission(self, request):
         return True
 
+    def save_formset(self, request, form, formset, change):
+        """
+        Saves the rows of an inline in a few statements. The rows are taken from the validated forms
+        rather than from the save of nested_admin, which fetches every row again. Deleted rows are
+        deleted at once, new rows of IncrementalIDKoreModel get their ids in one block and are
+        inserted at once, and changed rows are updated with one statement. The change form runs in
+        a transaction, so the whole form is committed at once.
+        """
+        model = formset.model
+        deleted_forms = formset.deleted_forms
+        formset.deleted_objects = [inline_form.instance for inline_form in deleted_forms
+                                   if inline_form in formset.initial_forms and inline_form.instance.pk is not None]
+        if formset.deleted_objects:
+            delete_in_bulk(model._base_manager.filter(pk__in=[obj.pk for obj in formset.deleted_objects]))
+        changed_forms = [inline_form for inline_form in formset.initial_forms
+                         if inline_form not in deleted_forms and inline_form.has_changed()]
+        new_forms = [inline_form for inline_form in formset.extra_forms
+                     if inline_form not in deleted_forms and inline_form.has_changed()]
+        # the forms hold the edited instances, with the foreign key to the parent set by save_new
+        formset.changed_objects = [(inline_form.save(commit=False), inline_form.changed_data)
+                                   for inline_form in changed_forms]
+        formset.new_objects = [formset.save_new(inline_form, commit=False) for inline_form in new_forms]
+        written = []
+        if issubclass(model, IncrementalIDKoreModel):
+            written = model.assign_ids(formset.new_objects)
+            model._base_manager.bulk_create(written)
+        else:
+            # the ids of other models are only known once saved
+            for obj in formset.new_objects:
+                obj.save()
+        changed = [obj for obj, changed_data in formset.changed_objects]
+        update_in_bulk(model, changed, set(name for inline_form in changed_forms for name in inline_form.changed_data))
+        for inline_form in changed_forms + new_forms:
+            inline_form.save_m2m()
+        # bulk writes send no post_save signals
+        notify_changed(model, [obj.pk for obj in written + changed])
+
+
+def update_in_bulk(model, instances, field_names, batch_size=500):
+    """
+    Writes the given fields of the instances with one UPDATE statement per batch.
+    """
+    fields = []
+    for name in field_names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.primary_key:
+            fields.append(field)
+    if not instances or not fields:
+        return
+    qn = connection.ops.quote_name
+    pk = model._meta.pk
+
+    def cast(field):
+        return 'integer' if isinstance(field, models.AutoField) else field.db_type(connection)
+
+    row = '(%s)' % ', '.join('%%s::%s' % cast(field) for field in [pk] + fields)
+    for i in range(0, len(instances), batch_size):
+        batch = instances[i:i + batch_size]
+        sql = 'UPDATE {table} SET {values} FROM (VALUES {rows}) AS v ({columns}) WHERE {table}.{pk} = v.pk'.format(
+            table=qn(model._meta.db_table), pk=qn(pk.column), rows=', '.join([row] * len(batch)),
+            columns=', '.join(['pk'] + ['v%d' % j for j in range(len(fields))]),
+            values=', '.join('%s = v.v%d' % (qn(field.column), j) for j, field in enumerate(fields)))
+        params = [field.get_db_prep_save(getattr(obj, field.attname), connection)
+                  for obj in batch for field in [pk] + fields]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class SchoolNameSearchMixin(object):
+    """
+    Also searches the names of the related school through the school search index
+    """
+    school_relation = 'school'
+
+    def get_search_results(self, request, queryset, search_term):
+        results, use_distinct = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # a single filter, as querysets with extra selects such as the photo flag cannot be combined with |
+            results = queryset.filter(Q(pk__in=results.values('pk')) |
+                                      Q(**{self.school_relation + '__in': matching_schools(search_term)}))
+        return results, use_distinct
+
+
+class DeferredInlineMixin(object):
+    """
+    Renders the existing rows of the inline only when asked for with the load parameter, and
+    per_page rows at a time, so that the change form opens at once however long the history of
+    the object. The links asking for the rows are shown in the heading of the inline, and reload
+    the form after asking whether to leave any unsaved changes.
+    """
+    per_page = 25
+
+    class Media:
+        js = ('schools/js/deferred_inlines.js',)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        prefix = formset.get_default_prefix()
+        loaded = request.GET.getlist('load')
+        if obj is None or obj.pk is None:
+            return formset
+        count = formset.model._default_manager.filter(**{formset.fk.name: obj}).count()
+        if prefix not in loaded and 'all' not in loaded:
+            rows = None
+            links = [(self.url(request, load=loaded + [prefix]), _('show %(count)d') % {'count': count})] if count else []
+        else:
+            pages = max((count - 1) // self.per_page + 1, 1)
+            try:
+                page = min(max(int(request.GET.get(prefix + '-page', 1)), 1), pages)
+            except ValueError:
+                page = 1
+            rows = slice((page - 1) * self.per_page, page * self.per_page)
+            links = [(self.url(request, **{prefix + '-page': number}), number)
+                     for number in range(1, pages + 1) if number != page] if pages > 1 else []
+        if links:
+            # the inline instances are created for each request, and the formset may be asked for more than once
+            self.verbose_name_plural = format_html(
+                '{} {}', type(self).verbose_name_plural or self.model._meta.verbose_name_plural,
+                format_html_join(' ', '<a class="deferred-inline-link" href="{}" data-confirm="{}">{}</a>',
+                                 ((url, _('Leave the form? The unsaved changes will be lost.'), text)
+                                  for url, text in links)))
+        return paginated_formset(formset, rows)
+
+    @staticmethod
+    def url(request, **params):
+        query = request.GET.copy()
+        for name, value in params.items():
+            if isinstance(value, list):
+                query.setlist(name, value)
+            else:
+                query[name] = value
+        return request.path + '?' + query.urlencode()
+
+
+def paginated_formset(formset, rows):
+    """
+    Returns the formset class limited to the existing rows in the slice ``rows``, or to none if it is None.
+    """
+    class PaginatedFormSet(formset):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if rows is None:
+                self.queryset = self.queryset.none()
+            else:
+                # rows sharing the ordering of the inline would otherwise move between pages
+                ordering = list(self.queryset.query.order_by or self.model._meta.ordering) + ['pk']
+                pks = self.queryset.order_by(*ordering).values_list('pk', flat=True)[rows]
+                self.queryset = self.queryset.filter(pk__in=list(pks))
+
+    PaginatedFormSet.__name__ = formset.__name__
+    return PaginatedFormSet
+
 
 class NameTypeInline(nested_admin.NestedStackedInline):
     model = NameType
@@ -28,7 +189,7 @@ class NameTypeInline(nested_admin.NestedStackedInline):
     exclude = ('id', )
 
 
-class SchoolNameInline(nested_admin.NestedTabularInline):
+class SchoolNameInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = SchoolName
     extra = 0
     exclude = ('id', 'reference', 'approx_begin', 'approx_end')
@@ -37,7 +198,7 @@ class SchoolNameInline(nested_admin.NestedTabularInline):
     classes = ('grp-collapse grp-open',)
 
 
-class SchoolContinuumActiveInline(nested_admin.NestedTabularInline):
+class SchoolContinuumActiveInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = SchoolContinuum
     fk_name = 'active_school'
     verbose_name = _("Action targeting another school")
@@ -52,7 +213,7 @@ class SchoolContinuumActiveInline(nested_admin.NestedTabularInline):
     classes = ('grp-collapse grp-open',)
 
 
-class SchoolContinuumTargetInline(nested_admin.NestedTabularInline):
+class SchoolContinuumTargetInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = SchoolContinuum
     fk_name = 'target_school'
     verbose_name = _("Action targeting this school")
@@ -67,7 +228,7 @@ class SchoolContinuumTargetInline(nested_admin.NestedTabularInline):
     classes = ('grp-collapse grp-open',)
 
 
-class LifeCycleEventInline(nested_admin.NestedTabularInline):
+class LifeCycleEventInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = LifecycleEvent
     extra = 0
     exclude = ('approx', 'decisionmaker', 'decision_day', 'decision_month', 'decision_year', 'additional_info', 'reference')
@@ -87,7 +248,7 @@ class SchoolLanguageInline(nested_admin.NestedTabularInline):
     extra = 0
 
 
-class SchoolTypeInline(nested_admin.NestedTabularInline):
+class SchoolTypeInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = SchoolType
     fk_name = 'school'
     extra = 0
@@ -96,7 +257,7 @@ class SchoolTypeInline(nested_admin.NestedTabularInline):
     classes = ('grp-collapse grp-open',)
 
 
-class EmployershipInline(nested_admin.NestedTabularInline):
+class EmployershipInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = Employership
     extra = 0
     exclude = ('id', 'nimen_id', 'reference', 'approx_begin', 'approx_end')
@@ -108,7 +269,7 @@ class EmployershipInline(nested_admin.NestedTabularInline):
     classes = ('grp-collapse grp-open',)
 
 
-class SchoolBuildingInline(nested_admin.NestedTabularInline):
+class SchoolBuildingInline(DeferredInlineMixin, nested_admin.NestedTabularInline):
     model = SchoolBuilding
     extra = 0
     exclude = ('id', 'ownership', 'reference', 'approx_begin', 'approx_end')
@@ -132,6 +293,9 @@ class SchoolAdmin(KoreAdmin):
                SchoolTypeInline,
                EmployershipInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_official_name()
+
 
 class BuildingAddressInline(nested_admin.NestedTabularInline):
     model = BuildingAddress
@@ -144,6 +308,9 @@ class BuildingAdmin(KoreAdmin):
     list_display = ('__str__',)
     inlines = [BuildingAddressInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_label()
+
 
 @admin.register(Principal)
 class PrincipalAdmin(KoreAdmin):
@@ -156,27 +323,50 @@ class ArchiveDataLinkInline(admin.TabularInline):
 
 
 @admin.register(ArchiveData)
-class ArchiveDataAdmin(KoreAdmin):
+class ArchiveDataAdmin(SchoolNameSearchMixin, KoreAdmin):
     fields = ('school', 'location')
     readonly_fields = fields
-    search_fields = ['school__names__types__value', 'location']
+    search_fields = ['location']
     list_display = ('__str__', 'link')
     inlines = [ArchiveDataLinkInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('school__official_name', 'link')
+
 
 class SchoolBuildingPhotoInline(admin.TabularInline):
     model = SchoolBuildingPhoto
 
 
+class SchoolBuildingHasPhotoFilter(admin.SimpleListFilter):
+    title = 'photo'
+    parameter_name = 'has_photo'
+
+    def lookups(self, request, model_admin):
+        return (('1', 'yes'), ('0', 'no'))
+
+    def queryset(self, request, queryset):
+        photographed = SchoolBuildingPhoto.objects.values('school_building')
+        if self.value() == '1':
+            return queryset.filter(pk__in=photographed)
+        if self.value() == '0':
+            return queryset.exclude(pk__in=photographed)
+        return queryset
+
+
 @admin.register(SchoolBuilding)
-class SchoolBuildingAdmin(KoreAdmin):
+class SchoolBuildingAdmin(SchoolNameSearchMixin, KoreAdmin):
     fields = ('school', 'building', 'begin_year', 'end_year')
     readonly_fields = fields
-    search_fields = ['school__names__types__value']
+    search_fields = ['building__label__value']
     list_display = ('__str__', 'has_photo')
-    list_filter = ('photos',)
+    list_filter = (SchoolBuildingHasPhotoFilter,)
     inlines = [SchoolBuildingPhotoInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('school__official_name', 'building__label')\
+            .with_photo_flag()
+
 
 class AddressHasLocationFilter(admin.SimpleListFilter):
     title = 'location'
@@ -201,6 +391,9 @@ class AddressLocationAdmin(geo_admin.OSMGeoAdmin):
     list_filter = (AddressHasLocationFilter, 'handmade', 'address__municipality_fi')
     ordering = ('address__street_name_fi',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_school_names()
+
     def save_model(self, request, obj, form, change):
         obj.handmade = True
         return super(AddressLocationAdmin, self).save_model(request, obj, form, change)
@@ -1,17 +1,295 @@
+import calendar
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
+from functools import partial
 
-from rest_framework import routers, serializers, viewsets, mixins, filters, relations
+from rest_framework import routers, serializers, viewsets, mixins, filters, relations, pagination
 from munigeo.api import GeoModelSerializer
 from rest_framework.serializers import ListSerializer, LIST_SERIALIZER_KWARGS
 
 from .models import *
+from .cache import cached_response, store_response
+from . import clusters
+from .documents import current_document, load_document, store_documents
+from .prefetch import get_query_plan
+from .search import search_schools
+from .spatial import order_by_distance, within_bbox, within_radius
 import django_filters
 from django import forms
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import six
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import lazy
+from django.utils.http import http_date, quote_etag
 from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 
 YEARS_OF_PRIVACY = 100
 
+
+def privacy_cutoff():
+    """
+    Returns the year before which employerships must have ended to be shown.
+    """
+    return datetime.now().year - YEARS_OF_PRIVACY
+
+
+def censor(queryset, cutoff=None):
+    """
+    Restricts Employership and Principal querysets to the ones that may be shown.
+    """
+    if cutoff is None:
+        cutoff = privacy_cutoff()
+    if queryset.model is Employership:
+        return queryset.filter(end_year__lt=cutoff)
+    if queryset.model is Principal:
+        return queryset.filter(employers__end_year__lt=cutoff).distinct()
+    return queryset
+
+
+def censor_related(iterable):
+    """
+    Censors a related Employership or Principal listing. Prefetched employerships are
+    filtered in memory, as filtering the queryset would query them again.
+    """
+    cutoff = privacy_cutoff()
+    if iterable.model is Employership and iterable._result_cache is not None:
+        return [item for item in iterable if item.end_year is not None and item.end_year < cutoff]
+    return censor(iterable, cutoff)
+
+
+class URLTemplateMixin(object):
+    """
+    Reverses the URL of each view once per request with a placeholder for the lookup value,
+    and fills in the value for each object, as reversing is slow.
+    """
+    URL_PLACEHOLDER = '0000000000'
+
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, 'pk') and obj.pk is None:
+            return None
+        lookup_value = getattr(obj, self.lookup_field)
+        # other values could be quoted when reversing, and versioning may rewrite the URLs
+        if (request is None or not isinstance(lookup_value, six.integer_types) or
+                getattr(request, 'versioning_scheme', None) is not None):
+            return super().get_url(obj, view_name, request, format)
+        if not hasattr(request, 'url_templates'):
+            request.url_templates = {}
+        key = (view_name, self.lookup_url_kwarg, format)
+        if key not in request.url_templates:
+            url = self.reverse(view_name, kwargs={self.lookup_url_kwarg: self.URL_PLACEHOLDER},
+                               request=request, format=format)
+            prefix, placeholder, suffix = url.partition(self.URL_PLACEHOLDER)
+            request.url_templates[key] = (prefix, suffix) if placeholder else None
+        template = request.url_templates[key]
+        if template is None:
+            return super().get_url(obj, view_name, request, format)
+        return template[0] + str(lookup_value) + template[1]
+
+
+class KoreHyperlinkedIdentityField(URLTemplateMixin, relations.HyperlinkedIdentityField):
+    """
+    Only evaluates the name of the linked object when the browsable API displays it,
+    as __str__ of most kore models runs queries.
+    """
+    def get_name(self, obj):
+        return lazy(six.text_type, six.text_type)(obj)
+
+
+class KoreModelSerializer(serializers.ModelSerializer):
+    serializer_url_field = KoreHyperlinkedIdentityField
+
+
+def _field_tree(paths):
+    tree = OrderedDict()
+    for path in paths:
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, OrderedDict())
+    return tree
+
+
+def select_fields(serializer, selection):
+    """
+    Prunes the serializer tree to the field paths selected by the fields and expand parameters.
+    """
+    fields, expand = selection
+    prune_serializer(serializer,
+                     None if fields is None else _field_tree(fields),
+                     None if expand is None else _field_tree(expand))
+
+
+def prune_serializer(serializer, fields=None, expand=None):
+    """
+    Removes the fields missing from the ``fields`` tree and renders the nested serializers
+    missing from the ``expand`` tree as primary keys. A tree of None leaves the level as it
+    is, as does an empty ``fields`` tree.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    for name in set(fields or ()) | set(expand or ()):
+        if name not in serializer.fields:
+            raise ParseError("Unknown field '%s'" % name)
+    for name in list(serializer.fields.keys()):
+        if fields and name not in fields:
+            del serializer.fields[name]
+            continue
+        field = serializer.fields[name]
+        if not isinstance(field, serializers.BaseSerializer):
+            continue
+        if expand is not None and name not in expand:
+            serializer.fields[name] = collapse_serializer(field)
+        else:
+            prune_serializer(field, fields.get(name) if fields else None,
+                             expand.get(name) if expand is not None else None)
+
+
+def collapse_serializer(field):
+    """
+    Returns a field rendering the primary keys of the instances the nested serializer ``field`` renders.
+    """
+    kwargs = {'read_only': True}
+    # DRF rejects a source equal to the name the field is bound to
+    if field.source != field.field_name:
+        kwargs['source'] = field.source
+    if isinstance(field, serializers.ListSerializer):
+        return CensoredManyRelatedField(child_relation=relations.PrimaryKeyRelatedField(read_only=True), **kwargs)
+    return relations.PrimaryKeyRelatedField(**kwargs)
+
+
+class KoreCursorPagination(pagination.CursorPagination):
+    """
+    Pages through the results in primary key order with opaque cursors, so that
+    deep pages are as fast as the first one and no count is needed.
+    """
+    ordering = 'id'
+    page_size = api_settings.PAGINATE_BY
+    page_size_query_param = api_settings.PAGINATE_BY_PARAM
+    max_page_size = api_settings.MAX_PAGINATE_BY
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return pagination._positive_int(request.query_params[self.page_size_query_param],
+                                                strict=True, cutoff=self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+
+class ConditionalResponseMixin(object):
+    """
+    Answers with 304 responses or cached renderings while the data version of the response
+    is unchanged.
+    """
+    # whether retrieved instances have data versions of their own, which requires the
+    # dependencies of their representation to be tracked in signals.DEPENDENCIES
+    object_versions = False
+
+    def get_data_version(self):
+        if self.action == 'retrieve' and self.object_versions:
+            lookup = self.lookup_url_kwarg or self.lookup_field
+            return DataVersion.get(DataVersion.key_for(self.queryset.model, self.kwargs[lookup]))
+        return DataVersion.get(DataVersion.GLOBAL)
+
+    def get_etag(self, request, data_version):
+        # the representation also depends on the format, the language and the privacy window
+        parts = (data_version.key, data_version.version, privacy_cutoff(),
+                 request.META.get('HTTP_ACCEPT', ''), request.META.get('HTTP_ACCEPT_LANGUAGE', ''))
+        return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def check_not_modified(self, request):
+        """
+        Returns a 304 response if the client has the current representation, before any rendering.
+        """
+        data_version = self.get_data_version()
+        self.etag = self.get_etag(request, data_version)
+        self.last_modified = None
+        if data_version.modified_at is not None:
+            self.last_modified = calendar.timegm(data_version.modified_at.utctimetuple())
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def respond(self, request, render, *args, **kwargs):
+        response = self.check_not_modified(request) or cached_response(self, request)
+        if response is None:
+            response = render(request, *args, **kwargs)
+            store_response(self, request, response)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = quote_etag(self.etag)
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+            patch_vary_headers(response, ('Accept', 'Accept-Language'))
+        return response
+
+
+class KoreViewSet(ConditionalResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Fetches all the relations rendered by the serializer along with the queryset,
+    so that each page is rendered with a fixed number of queries.
+    """
+    def get_queryset(self):
+        # the privacy window is applied to the queryset and every prefetched relation
+        refine = partial(censor, cutoff=privacy_cutoff())
+        queryset = refine(super().get_queryset())
+        selection = self.get_field_selection()
+        plan = get_query_plan(self.get_serializer_class(), selection, select_fields if selection else None)
+        return plan.apply(queryset, refine)
+
+    def get_field_selection(self):
+        """
+        Returns the field paths given in the fields and expand parameters, or None if neither is given.
+        """
+        params = self.request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        return tuple(
+            tuple(sorted(set(path.strip() for path in params[name].split(',') if path.strip())))
+            if name in params else None
+            for name in ('fields', 'expand')
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        selection = self.get_field_selection()
+        if selection:
+            select_fields(serializer, selection)
+        return serializer
+
+    def list(self, request, *args, **kwargs):
+        return self.respond(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respond(request, super().retrieve, *args, **kwargs)
+
+    # the parameters ordering the results by relevance, which the cursor pages cannot follow
+    ordering_params = ('near',)
+
+    @property
+    def paginator(self):
+        """
+        Cursor pagination is used when asked for with the cursor parameter, starting from ?cursor=.
+        The cursor pages in primary key order, so it cannot be combined with the parameters ordering
+        the results by relevance, such as ?near=.
+        """
+        params = self.request.query_params
+        if not hasattr(self, '_paginator') and 'cursor' in params:
+            ordering = [name for name in self.ordering_params if params.get(name)]
+            if ordering:
+                raise ParseError("cursor cannot be combined with %s" % ', '.join(ordering))
+            self._paginator = KoreCursorPagination()
+        return super().paginator
+
+
 # for censoring principals in related instances
 
 class CensoredManyRelatedField(relations.ManyRelatedField):
@@ -19,11 +297,7 @@ class CensoredManyRelatedField(relations.ManyRelatedField):
     Handles view permissions for related field listings with Principal or Employership instances.
     """
     def to_representation(self, iterable):
-        if iterable.model is Employership:
-            iterable = iterable.filter(end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
-        if iterable.mode is Principal:
-            iterable.filter(employers__end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
-        return super().to_representation(iterable)
+        return super().to_representation(censor_related(iterable))
 
 
 class CensoredListSerializer(serializers.ListSerializer):
@@ -39,16 +313,13 @@ class CensoredListSerializer(serializers.ListSerializer):
         # so, first get a queryset from the Manager if needed
         iterable = data.all() if isinstance(data, models.Manager) else data
 
-        if iterable.model is Employership:
-            iterable = iterable.filter(end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
-        if iterable.model is Principal:
-            iterable = iterable.filter(employers__end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
+        iterable = censor_related(iterable)
         return [
             self.child.to_representation(item) for item in iterable
         ]
 
 
-class CensoredHyperlinkedRelatedField(relations.HyperlinkedRelatedField):
+class CensoredHyperlinkedRelatedField(URLTemplateMixin, relations.HyperlinkedRelatedField):
     """
     Handles view permissions for related field listings with Principal or Employership instances.
     """
@@ -67,6 +338,7 @@ class CensoredHyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer)
     Handles view permissions for related field listings with Principal or Employership instances.
     """
     serializer_related_field = CensoredHyperlinkedRelatedField
+    serializer_url_field = KoreHyperlinkedIdentityField
 
 # the actual serializers
 
@@ -81,6 +353,9 @@ class SchoolNameSerializer(serializers.ModelSerializer):
     class Meta:
         model = SchoolName
         exclude = ('school',)
+        # official and other names are picked from the name types
+        prefetch_related = ('types',)
+        ordering = ('begin_year', 'begin_month', 'begin_day')
 
 
 class SchoolLanguageSerializer(serializers.ModelSerializer):
@@ -96,7 +371,7 @@ class LanguageSerializer(serializers.ModelSerializer):
         model = Language
 
 
-class LanguageViewSet(viewsets.ReadOnlyModelViewSet):
+class LanguageViewSet(KoreViewSet):
     queryset = Language.objects.all()
     serializer_class = LanguageSerializer
 
@@ -106,7 +381,7 @@ class SchoolTypeNameSerializer(serializers.ModelSerializer):
         model = SchoolTypeName
 
 
-class SchoolTypeNameViewSet(viewsets.ReadOnlyModelViewSet):
+class SchoolTypeNameViewSet(KoreViewSet):
     queryset = SchoolTypeName.objects.all()
     serializer_class = SchoolTypeNameSerializer
     paginate_by = 50
@@ -118,6 +393,7 @@ class SchoolTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = SchoolType
         exclude = ('school',)
+        ordering = ('begin_year', 'begin_month', 'begin_day')
 
 
 class SchoolFieldNameSerializer(serializers.ModelSerializer):
@@ -128,7 +404,7 @@ class SchoolFieldNameSerializer(serializers.ModelSerializer):
         exclude = ('description',)
 
 
-class SchoolFieldNameViewSet(viewsets.ReadOnlyModelViewSet):
+class SchoolFieldNameViewSet(KoreViewSet):
     queryset = SchoolFieldName.objects.all()
     serializer_class = SchoolFieldNameSerializer
 
@@ -169,7 +445,8 @@ class AddressSerializer(serializers.ModelSerializer):
 
     def to_representation(self, obj):
         ret = super(AddressSerializer, self).to_representation(obj)
-        if ret['location']:
+        # the location may have been left out or collapsed with the fields and expand parameters
+        if isinstance(ret.get('location'), dict):
             ret['location'] = ret['location']['location']
         return ret
 
@@ -229,6 +506,8 @@ class SchoolBuildingPhotoSerializer(serializers.ModelSerializer):
         # we have to reformat the URL representation so that our API serves the corresponding photo URL
         # this method will have to be updated whenever Finna API changes!
         representation = super(SchoolBuildingPhotoSerializer, self).to_representation(instance)
+        if 'url' not in representation:
+            return representation
         representation['url'] = representation['url'].replace(
             '.finna.fi/Record/',
             '.finna.fi/Cover/Show?id='
@@ -240,7 +519,7 @@ class SchoolBuildingPhotoSerializer(serializers.ModelSerializer):
         exclude = ('school_building',)
 
 
-class BuildingForSchoolSerializer(serializers.ModelSerializer):
+class BuildingForSchoolSerializer(KoreModelSerializer):
     neighborhood = serializers.CharField(source='neighborhood.name')
     addresses = AddressSerializer(many=True)
     owners = BuildingOwnershipSerializer(many=True)
@@ -255,9 +534,11 @@ class BuildingForSchoolSerializer(serializers.ModelSerializer):
         fields = ('url', 'id', 'neighborhood', 'addresses', 'construction_year',
                   'architect', 'architect_firm', 'property_number', 'sliced',
                   'comment', 'reference', 'approx', 'owners', 'photos')
+        # photos are collected from all school buildings
+        prefetch_related = ('schools__photos',)
 
 
-class PrincipalForSchoolSerializer(serializers.ModelSerializer):
+class PrincipalForSchoolSerializer(KoreModelSerializer):
     """
     This class is needed for the School endpoint
     """
@@ -276,9 +557,10 @@ class EmployershipForSchoolSerializer(serializers.ModelSerializer):
         model = Employership
         list_serializer_class = CensoredListSerializer
         exclude = ('nimen_id',)
+        ordering = ('begin_year', 'begin_month', 'begin_day')
 
 
-class SchoolBuildingForSchoolSerializer(serializers.ModelSerializer):
+class SchoolBuildingForSchoolSerializer(KoreModelSerializer):
     """
     This class is needed for the School and Principal endpoints
     """
@@ -292,6 +574,7 @@ class SchoolBuildingForSchoolSerializer(serializers.ModelSerializer):
         fields = ('url', 'id', 'building', 'photos', 'approx_begin', 'approx_end',
                   'begin_day', 'begin_month', 'begin_year', 'end_day', 'end_month', 'end_year',
                   'ownership', 'reference',)
+        ordering = ('begin_year', 'begin_month', 'begin_day')
 
 
 class SchoolforSchoolContinuumSerializer(CensoredHyperlinkedModelSerializer):
@@ -309,14 +592,16 @@ class SchoolContinuumActiveSerializer(CensoredHyperlinkedModelSerializer):
     def to_representation(self, instance):
         # translate joins and separations to English
         representation = super().to_representation(instance)
-        representation['description'] = representation['description'].replace(
-            'yhdistyy', 'joins').replace('eroaa', 'separates from')
+        if 'description' in representation:
+            representation['description'] = representation['description'].replace(
+                'yhdistyy', 'joins').replace('eroaa', 'separates from')
         return representation
 
     class Meta:
         model = SchoolContinuum
         fields = ('active_school', 'description', 'target_school', 'day', 'month', 'year',
                   'reference',)
+        ordering = ('year', 'month', 'day')
 
 
 class SchoolContinuumTargetSerializer(CensoredHyperlinkedModelSerializer):
@@ -325,14 +610,16 @@ class SchoolContinuumTargetSerializer(CensoredHyperlinkedModelSerializer):
     def to_representation(self, instance):
         # translate joins and separations to English
         representation = super().to_representation(instance)
-        representation['description'] = representation['description'].replace(
-            'yhdistyy', 'joins').replace('eroaa', 'separates from')
+        if 'description' in representation:
+            representation['description'] = representation['description'].replace(
+                'yhdistyy', 'joins').replace('eroaa', 'separates from')
         return representation
 
     class Meta:
         model = SchoolContinuum
         fields = ('active_school', 'description', 'target_school', 'day', 'month', 'year',
                   'reference',)
+        ordering = ('year', 'month', 'day')
 
 
 class LifecycleEventSerializer(serializers.ModelSerializer):
@@ -341,6 +628,7 @@ class LifecycleEventSerializer(serializers.ModelSerializer):
     class Meta:
         model = LifecycleEvent
         fields = ('description', 'day', 'month', 'year', 'decisionmaker', 'additional_info')
+        ordering = ('year', 'month', 'day')
 
 
 class SchoolSerializer(CensoredHyperlinkedModelSerializer):
@@ -368,6 +656,36 @@ class SchoolSerializer(CensoredHyperlinkedModelSerializer):
                   'archives', 'lifecycle_event', 'continuum_active', 'continuum_target')
 
 
+class StoredSchoolListSerializer(serializers.ListSerializer):
+    """
+    Renders the schools missing a current stored document in one go, storing them on the way.
+    """
+
+    def to_representation(self, data):
+        schools = list(data)
+        missing = [school.id for school in schools if current_document(school) is None]
+        documents = dict((document.school_id, document) for document in store_documents(missing)) if missing else {}
+        request = self.context['request']
+        return [
+            load_document(current_document(school) or documents[school.id], request) for school in schools
+        ]
+
+
+class StoredSchoolSerializer(serializers.Serializer):
+    """
+    Serves the SchoolSerializer representation from the stored school documents.
+    """
+
+    def to_representation(self, instance):
+        document = current_document(instance) or store_documents([instance.id])[0]
+        return load_document(document, self.context['request'])
+
+    class Meta:
+        model = School
+        list_serializer_class = StoredSchoolListSerializer
+        prefetch_related = ('document',)
+
+
 class SchoolBuildingSerializer(CensoredHyperlinkedModelSerializer):
     photos = SchoolBuildingPhotoSerializer(many=True)
     school = SchoolSerializer()
@@ -391,7 +709,7 @@ class EmployershipForPrincipalSerializer(serializers.ModelSerializer):
         exclude = ('nimen_id',)
 
 
-class PrincipalSerializer(serializers.ModelSerializer):
+class PrincipalSerializer(KoreModelSerializer):
     employers = EmployershipForPrincipalSerializer(many=True)
 
     class Meta:
@@ -410,7 +728,7 @@ class EmployershipSerializer(EmployershipForSchoolSerializer):
         exclude = ('nimen_id',)
 
 
-class SchoolBuildingForBuildingSerializer(serializers.ModelSerializer):
+class SchoolBuildingForBuildingSerializer(KoreModelSerializer):
     photos = SchoolBuildingPhotoSerializer(many=True)
     school = SchoolSerializer()
 
@@ -433,20 +751,54 @@ class BuildingSerializer(serializers.ModelSerializer):
         exclude = ('photo',)
 
 
-class InclusiveFilter(django_filters.Filter):
+def filter_period(queryset, relation, from_year, until_year):
     """
-    Filter for including entries where the field is null
+    Restricts the queryset to instances with a period overlapping the given years, using
+    the period indexes of the temporal tables. The periods are found through ``relation``,
+    or in the instances themselves if it is None. Open ends of periods are unbounded.
     """
-
-    def filter(self, qs, value):
-        originalqs = super().filter(qs, value)
-        self.lookup_type = 'isnull'
-        nullqs = super().filter(qs, value)
-        return nullqs | originalqs
-
-
-class InclusiveNumberFilter(InclusiveFilter):
-    field_class = forms.DecimalField
+    model = queryset.model
+    if relation is not None:
+        field = model._meta.get_field(relation)
+        model = field.related_model
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    condition = "kore_year_range(%s.%s, %s.%s) && int4range(%%s, %%s, '[]')" % (
+        table, qn(model._meta.get_field('begin_year').column),
+        table, qn(model._meta.get_field('end_year').column))
+    params = [from_year, until_year]
+    if relation is None:
+        return queryset.extra(where=[condition], params=params)
+    periods = model._default_manager.extra(where=[condition], params=params)
+    return queryset.filter(pk__in=periods.values(field.field.name))
+
+
+class PeriodFilterSet(django_filters.FilterSet):
+    """
+    FilterSet for instances active between from_year and until_year
+    """
+    # both years are applied at once in qs
+    from_year = django_filters.NumberFilter(action=lambda qs, value: qs)
+    until_year = django_filters.NumberFilter(action=lambda qs, value: qs)
+    # the relation to the instances with the periods, or None if the filtered model has them
+    period_relation = None
+
+    @property
+    def qs(self):
+        if not hasattr(self, '_qs'):
+            qs = super().qs
+            if self.is_bound and self.form.is_valid():
+                from_year = self.form.cleaned_data.get('from_year')
+                until_year = self.form.cleaned_data.get('until_year')
+                if from_year is not None and until_year is not None and from_year > until_year:
+                    # no period overlaps an inverted range, which int4range would reject
+                    qs = qs.none()
+                elif from_year is not None or until_year is not None:
+                    qs = filter_period(qs, self.period_relation,
+                                       None if from_year is None else int(from_year),
+                                       None if until_year is None else int(until_year))
+            self._qs = qs
+        return self._qs
 
 
 class NameOrIdFilter(django_filters.Filter):
@@ -492,10 +844,8 @@ class GenderFilter(django_filters.CharFilter):
         return super().filter(qs, value)
 
 
-class SchoolFilter(django_filters.FilterSet):
-    # the end year can be null, so we cannot use a default filter
-    from_year = InclusiveNumberFilter(name="names__end_year", lookup_type='gte')
-    until_year = django_filters.NumberFilter(name="names__begin_year", lookup_type='lte')
+class SchoolFilter(PeriodFilterSet):
+    period_relation = 'names'
     type = NameOrIdFilter(name="types__type__name", lookup_type='iexact')
     field = NameOrIdFilter(name="fields__field__description", lookup_type='iexact')
     language = NameOrIdFilter(name="languages__language__name", lookup_type='iexact')
@@ -511,12 +861,68 @@ class SchoolFilter(django_filters.FilterSet):
                   'until_year']
 
 
-class SchoolViewSet(viewsets.ReadOnlyModelViewSet):
+class SchoolNameSearchFilter(filters.BaseFilterBackend):
+    """
+    Searches schools by all their names with the q (or search) parameter, the most relevant first
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get('q') or request.query_params.get('search')
+        if not query:
+            return queryset
+        return search_schools(queryset, query)
+
+
+class LocationFilter(filters.BaseFilterBackend):
+    """
+    Finds the results located within ?bbox=west,south,east,north or within ?radius= metres
+    of ?near=lon,lat, the nearest to ?near first
+    """
+
+    @staticmethod
+    def parse_coordinates(params, name, count):
+        try:
+            values = [float(value) for value in params[name].split(',')]
+        except ValueError:
+            values = []
+        # longitudes and latitudes alternate
+        if len(values) != count or not all(abs(value) <= (90 if i % 2 else 180) for i, value in enumerate(values)):
+            raise ParseError("%s must be %d comma separated WGS84 coordinates" % (name, count))
+        return values
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if 'bbox' in params:
+            queryset = within_bbox(queryset, *self.parse_coordinates(params, 'bbox', 4))
+        if 'near' not in params:
+            if 'radius' in params:
+                raise ParseError("radius requires near")
+            return queryset
+        lon, lat = self.parse_coordinates(params, 'near', 2)
+        if 'radius' in params:
+            try:
+                radius = float(params['radius'])
+            except ValueError:
+                radius = -1
+            if not radius >= 0:
+                raise ParseError("radius must be a distance in metres")
+            queryset = within_radius(queryset, lon, lat, radius)
+        return order_by_distance(queryset, lon, lat)
+
+
+class SchoolViewSet(KoreViewSet):
     queryset = School.objects.all()
     serializer_class = SchoolSerializer
-    filter_backends = (filters.SearchFilter, filters.DjangoFilterBackend)
+    filter_backends = (SchoolNameSearchFilter, LocationFilter, filters.DjangoFilterBackend)
     filter_class = SchoolFilter
-    search_fields = ('names__types__value',)
+    ordering_params = ('q', 'search', 'near')
+    object_versions = True
+
+    def get_serializer_class(self):
+        # the stored documents hold the full representation
+        if settings.SCHOOL_DOCUMENT_STORE and not self.get_field_selection():
+            return StoredSchoolSerializer
+        return super().get_serializer_class()
 
 
 class NameFilter(django_filters.CharFilter):
@@ -540,10 +946,8 @@ class NameFilter(django_filters.CharFilter):
         return first_name_qs | surname_qs
 
 
-class PrincipalFilter(django_filters.FilterSet):
-    # the end year can be null, so we cannot use a default filter
-    from_year = InclusiveNumberFilter(name="employers__end_year", lookup_type='gte')
-    until_year = django_filters.NumberFilter(name="employers__begin_year", lookup_type='lte')
+class PrincipalFilter(PeriodFilterSet):
+    period_relation = 'employers'
     search = NameFilter(name="surname", lookup_type='icontains')
     school_type = NameOrIdFilter(name="employers__school__types__type__name", lookup_type='iexact')
     school_field = NameOrIdFilter(name="employers__school__fields__field__description", lookup_type='iexact')
@@ -561,10 +965,7 @@ class PrincipalFilter(django_filters.FilterSet):
                   'school_gender']
 
 
-class EmployershipFilter(django_filters.FilterSet):
-    # the end year can be null, so we cannot use a default filter
-    from_year = InclusiveNumberFilter(name="end_year", lookup_type='gte')
-    until_year = django_filters.NumberFilter(name="begin_year", lookup_type='lte')
+class EmployershipFilter(PeriodFilterSet):
     search = NameFilter(name="principal__surname", lookup_type='icontains')
     school_type = NameOrIdFilter(name="school__types__type__name", lookup_type='iexact')
     school_field = NameOrIdFilter(name="school__fields__field__description", lookup_type='iexact')
@@ -582,15 +983,15 @@ class EmployershipFilter(django_filters.FilterSet):
                   'school_gender']
 
 
-class PrincipalViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Principal.objects.filter(employers__end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
+class PrincipalViewSet(KoreViewSet):
+    queryset = Principal.objects.all()
     serializer_class = PrincipalSerializer
     filter_backends = (filters.SearchFilter, filters.DjangoFilterBackend)
     filter_class = PrincipalFilter
 
 
-class EmployershipViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Employership.objects.filter(end_year__lt=datetime.now().year-YEARS_OF_PRIVACY)
+class EmployershipViewSet(KoreViewSet):
+    queryset = Employership.objects.all()
     serializer_class = EmployershipSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = EmployershipFilter
@@ -602,17 +1003,16 @@ class AddressFilter(django_filters.CharFilter):
     """
 
     def filter(self, qs, value):
-        self.name = 'building__buildingaddress__address__street_name_fi'
-        street_name_fi_qs = super().filter(qs, value)
-        self.name = 'building__buildingaddress__address__street_name_sv'
-        street_name_sv_qs = super().filter(qs, value)
-        return street_name_fi_qs | street_name_sv_qs
+        if value in ([], (), {}, None, ''):
+            return qs
+        # a single filter, as querysets with extra selects such as the distance cannot be combined with |
+        address = self.name.rpartition('__')[0]
+        qs = qs.filter(Q(**{'%s__street_name_fi__%s' % (address, self.lookup_type): value}) |
+                       Q(**{'%s__street_name_sv__%s' % (address, self.lookup_type): value}))
+        return qs.distinct() if self.distinct else qs
 
 
-class SchoolBuildingFilter(django_filters.FilterSet):
-    # the end year can be null, so we cannot use a default filter
-    from_year = InclusiveNumberFilter(name="end_year", lookup_type='gte')
-    until_year = django_filters.NumberFilter(name="begin_year", lookup_type='lte')
+class SchoolBuildingFilter(PeriodFilterSet):
     search = AddressFilter(name="building__buildingaddress__address__street_name_fi", lookup_type='icontains')
     school_type = NameOrIdFilter(name="school__types__type__name", lookup_type='iexact')
     school_field = NameOrIdFilter(name="school__fields__field__description", lookup_type='iexact')
@@ -630,10 +1030,8 @@ class SchoolBuildingFilter(django_filters.FilterSet):
                   'school_gender']
 
 
-class BuildingFilter(django_filters.FilterSet):
-    # the end year can be null, so we cannot use a default filter
-    from_year = InclusiveNumberFilter(name="schools__end_year", lookup_type='gte')
-    until_year = django_filters.NumberFilter(name="schools__begin_year", lookup_type='lte')
+class BuildingFilter(PeriodFilterSet):
+    period_relation = 'schools'
     search = AddressFilter(name="buildingaddress__address__street_name_fi", lookup_type='icontains')
     school_type = NameOrIdFilter(name="schools__school__types__type__name", lookup_type='iexact')
     school_field = NameOrIdFilter(name="schools__school__fields__field__description", lookup_type='iexact')
@@ -651,20 +1049,57 @@ class BuildingFilter(django_filters.FilterSet):
                   'school_gender']
 
 
-class SchoolBuildingViewSet(viewsets.ReadOnlyModelViewSet):
+class SchoolBuildingViewSet(KoreViewSet):
     queryset = SchoolBuilding.objects.all()
     serializer_class = SchoolBuildingSerializer
     filter_backends = (filters.SearchFilter, filters.DjangoFilterBackend)
     filter_class = SchoolBuildingFilter
 
 
-class BuildingViewSet(viewsets.ReadOnlyModelViewSet):
+class BuildingViewSet(KoreViewSet):
     queryset = Building.objects.all()
     serializer_class = BuildingSerializer
-    filter_backends = (filters.SearchFilter, filters.DjangoFilterBackend)
+    filter_backends = (filters.SearchFilter, LocationFilter, filters.DjangoFilterBackend)
     filter_class = BuildingFilter
 
 
+class ClusterViewSet(ConditionalResponseMixin, viewsets.ViewSet):
+    """
+    Clusters of the located school buildings for maps at ?zoom=, optionally within
+    ?bbox=west,south,east,north and for the schools located there from ?from_year= until ?until_year=
+    """
+
+    @staticmethod
+    def parse_int(params, name, minimum=None, maximum=None):
+        try:
+            value = int(params[name])
+        except ValueError:
+            raise ParseError("%s must be an integer" % name)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ParseError("%s must be between %s and %s" % (name, minimum, maximum))
+        return value
+
+    def list(self, request, *args, **kwargs):
+        return self.respond(request, self.list_clusters)
+
+    def list_clusters(self, request):
+        params = request.query_params
+        if 'zoom' not in params:
+            raise ParseError("zoom is required")
+        zoom = self.parse_int(params, 'zoom', 0, clusters.MAX_ZOOM)
+        bbox = [-180, -90, 180, 90]
+        if 'bbox' in params:
+            bbox = LocationFilter.parse_coordinates(params, 'bbox', 4)
+        years = None
+        if 'from_year' in params or 'until_year' in params:
+            years = tuple(self.parse_int(params, name) if name in params else None
+                          for name in ('from_year', 'until_year'))
+        return Response(OrderedDict([
+            ('zoom', zoom),
+            ('clusters', clusters.index.grid(zoom).clusters_in(*bbox, years=years)),
+        ]))
+
+
 router = routers.DefaultRouter()
 router.register(r'school', SchoolViewSet)
 router.register(r'principal', PrincipalViewSet)
@@ -674,3 +1109,4 @@ router.register(r'school_type', SchoolTypeNameViewSet)
 router.register(r'language', LanguageViewSet)
 router.register(r'building', BuildingViewSet)
 router.register(r'school_building', SchoolBuildingViewSet)
+router.register(r'cluster', ClusterViewSet, base_name='cluster')
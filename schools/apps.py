@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SchoolsConfig(AppConfig):
+    name = 'schools'
+
+    def ready(self):
+        # connect the signal handlers keeping derived data up to date
+        from . import signals, documents, autocomplete
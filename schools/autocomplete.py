@@ -0,0 +1,160 @@
+"""
+Answers the autocomplete lookups of the admin from per-process indexes of the
+display labels of schools, buildings and principals.
+
+Each index keeps the normalized words describing its instances in a sorted
+list, so that the instances with words starting with a prefix are found by
+bisection. The indexes are built when the process starts, with build_indexes,
+and updated from ``data_changed``. As saves in other processes are not seen,
+an index is built again in the background once the global data version differs
+from the one it was built at, while the lookups are answered from the old one.
+"""
+import threading
+from bisect import bisect_left, insort
+
+from django.db import connection
+from django.dispatch import receiver
+
+from .models import *
+from .signals import data_changed
+from .text import normalize
+
+
+class LabelIndex(object):
+    """
+    The labels of the instances of a model, searchable by word prefixes.
+    """
+
+    def __init__(self, model, load):
+        self.model = model
+        # returns (id, label, words) for the instances with the given ids, or for all if ids is None
+        self.load = load
+        self.lock = threading.Lock()
+        # the global data version the index was built at, None until built
+        self.version = None
+        self.rebuilding = False
+        self.labels = {}
+        self.words = {}
+        self.entries = []
+
+    def build(self):
+        # read before loading, so that changes saved during the load cause another build
+        version = DataVersion.get(DataVersion.GLOBAL).version
+        labels, words, entries = {}, {}, []
+        for pk, label, texts in self.load(None):
+            labels[pk] = label
+            words[pk] = self._words(texts)
+            entries.extend((word, pk) for word in words[pk])
+        entries.sort()
+        with self.lock:
+            self.labels, self.words, self.entries = labels, words, entries
+            self.version = version
+
+    def _rebuild(self):
+        try:
+            self.build()
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def update(self, pks):
+        with self.lock:
+            if self.version is None:
+                return
+            pks = set(pks)
+            for pk in pks:
+                self._remove(pk)
+            for pk, label, texts in self.load(pks):
+                self.labels[pk] = label
+                self.words[pk] = self._words(texts)
+                for word in self.words[pk]:
+                    insort(self.entries, (word, pk))
+
+    def search(self, term, limit):
+        """
+        Returns (id, label) of the instances with a word starting with every word of ``term``, ordered by label.
+        """
+        if self.version is None:
+            # not built at startup
+            self.build()
+        elif not self.rebuilding and DataVersion.get(DataVersion.GLOBAL).version != self.version:
+            self.rebuilding = True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+        with self.lock:
+            found = None
+            for prefix in normalize(term).split():
+                pks = set()
+                i = bisect_left(self.entries, (prefix,))
+                while i < len(self.entries) and self.entries[i][0].startswith(prefix):
+                    pks.add(self.entries[i][1])
+                    i += 1
+                found = pks if found is None else found & pks
+                if not found:
+                    return []
+            if found is None:
+                return []
+            return sorted(((pk, self.labels[pk]) for pk in found), key=lambda item: (item[1], item[0]))[:limit]
+
+    def _remove(self, pk):
+        for word in self.words.pop(pk, ()):
+            i = bisect_left(self.entries, (word, pk))
+            if i < len(self.entries) and self.entries[i] == (word, pk):
+                del self.entries[i]
+        self.labels.pop(pk, None)
+
+    @staticmethod
+    def _words(texts):
+        words = set()
+        for text in texts:
+            words.update(normalize(text or '').split())
+        return words
+
+
+def _filter_ids(queryset, ids, lookup='id'):
+    if ids is None:
+        return queryset
+    return queryset.filter(**{lookup + '__in': ids})
+
+
+def load_schools(ids):
+    texts = {}
+    for school_id, value in _filter_ids(SchoolSearchTerm.objects, ids, 'school').values_list('school', 'value'):
+        texts.setdefault(school_id, []).append(value)
+    for school_id, name in _filter_ids(School.objects, ids).values_list('id', 'official_name__value'):
+        yield school_id, name if name is not None else '<no name>', texts.get(school_id, [])
+
+
+def load_buildings(ids):
+    texts = {}
+    for building_id, street in _filter_ids(BuildingAddress.objects, ids, 'building')\
+            .values_list('building', 'address__street_name_fi'):
+        texts.setdefault(building_id, []).append(street)
+    for building_id, label in _filter_ids(Building.objects, ids).values_list('id', 'label__value'):
+        yield building_id, label or '<no address>', texts.get(building_id, []) + [label]
+
+
+def load_principals(ids):
+    for principal_id, surname, first_name in _filter_ids(Principal.objects, ids)\
+            .values_list('id', 'surname', 'first_name'):
+        yield principal_id, str(surname) + ', ' + str(first_name), [surname, first_name]
+
+
+indexes = {
+    School: LabelIndex(School, load_schools),
+    Building: LabelIndex(Building, load_buildings),
+    Principal: LabelIndex(Principal, load_principals),
+}
+
+
+def build_indexes():
+    """
+    Builds the indexes, so that the first lookups need not wait for them.
+    """
+    for index in indexes.values():
+        index.build()
+
+
+@receiver(data_changed)
+def update_indexes(sender, pks, **kwargs):
+    if sender in indexes:
+        indexes[sender].update(pks)
@@ -0,0 +1,97 @@
+"""
+Caches the rendered responses of the API.
+
+Responses are cached by URL, language and accepted format along with the ETag
+of the data version they were rendered from. A response outdated by a save is
+still served, while a single thread per entry renders it again in the
+background, so that cached pages never wait for the database. The browsable
+API is not cached, as its pages depend on the user.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.http import urlencode
+
+# seconds a refresh may take before another one is started
+REFRESH_TIMEOUT = 60
+
+
+def cache_key(request):
+    query = urlencode(sorted((key, sorted(values)) for key, values in request.GET.lists()), doseq=True)
+    parts = (request.scheme, request.get_host(), request.path, query,
+             getattr(request, 'LANGUAGE_CODE', ''), request.META.get('HTTP_ACCEPT', ''))
+    return 'api-response:' + hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def is_cacheable(request):
+    return request.method == 'GET' and request.accepted_renderer.format != 'api'
+
+
+def cached_response(view, request):
+    """
+    Returns the cached response for the request, or None if it has to be rendered.
+    """
+    if not is_cacheable(request) or getattr(request._request, 'refreshing_cache', False):
+        return None
+    key = cache_key(request)
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry['etag'] != view.etag:
+        refresh(request, key)
+        # the client gets the version of the data it was rendered from
+        view.etag, view.last_modified = entry['etag'], None
+    return HttpResponse(entry['content'], content_type=entry['content_type'])
+
+
+def store_response(view, request, response):
+    """
+    Caches the response once it has been rendered.
+    """
+    if not is_cacheable(request) or response.status_code != 200:
+        return
+    key, etag = cache_key(request), view.etag
+
+    def store(response):
+        cache.set(key, {
+            'etag': etag,
+            'content': response.content,
+            'content_type': response['Content-Type'],
+        }, settings.API_CACHE_TIMEOUT)
+
+    response.add_post_render_callback(store)
+
+
+def refresh(request, key):
+    """
+    Renders the response for the request again in a background thread.
+    """
+    if not cache.add(key + ':refreshing', True, REFRESH_TIMEOUT):
+        return
+    environ = request._request.environ.copy()
+    for header in ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE'):
+        environ.pop(header, None)
+    fresh_request = WSGIRequest(environ)
+    fresh_request.LANGUAGE_CODE = getattr(request, 'LANGUAGE_CODE', '')
+    fresh_request.refreshing_cache = True
+    match = request._request.resolver_match
+    thread = threading.Thread(target=_render, args=(
+        match.func, fresh_request, match.args, match.kwargs, translation.get_language(), key))
+    thread.daemon = True
+    thread.start()
+
+
+def _render(view_func, request, args, kwargs, language, key):
+    try:
+        with translation.override(language):
+            response = view_func(request, *args, **kwargs)
+            response.render()
+    finally:
+        cache.delete(key + ':refreshing')
+        connection.close()
@@ -0,0 +1,127 @@
+"""
+Groups the located school buildings into clusters for maps.
+
+The locations are grouped by the cells of a grid over the Web Mercator
+projection, CELLS_PER_TILE cells across each 256 pixel map tile of the zoom
+level, so that the clusters of a zoom level do not overlap on screen. The grid
+of a zoom level is built on its first request and kept until the global data
+version changes, so that panning the map only looks up the cells in view.
+Clusters restricted to a year range are aggregated from the school buildings
+of the cells in view.
+"""
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+
+from .models import *
+
+MAX_ZOOM = 18
+CELLS_PER_TILE = 4
+# number of school ids given for each cluster
+REPRESENTATIVES = 5
+MAX_LATITUDE = 85.0511287798
+
+
+def project(lon, lat):
+    """
+    Returns the Web Mercator coordinates of the point, scaled to the unit square.
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    return (lon + 180) / 360.0, (1 - y / math.pi) / 2
+
+
+def overlaps(begin_year, end_year, from_year, until_year):
+    # open ends are unbounded and inverted periods are swapped, as in filter_period
+    if begin_year is not None and end_year is not None and begin_year > end_year:
+        begin_year, end_year = end_year, begin_year
+    return ((until_year is None or begin_year is None or begin_year <= until_year) and
+            (from_year is None or end_year is None or end_year >= from_year))
+
+
+def aggregate(points):
+    """
+    Returns the cluster of the (school id, lon, lat, begin year, end year) points, or None if there are none.
+    """
+    if not points:
+        return None
+    schools = sorted(set(point[0] for point in points))
+    return OrderedDict([
+        ('lon', sum(point[1] for point in points) / len(points)),
+        ('lat', sum(point[2] for point in points) / len(points)),
+        ('count', len(schools)),
+        ('schools', schools[:REPRESENTATIVES]),
+    ])
+
+
+def load_points():
+    path = 'address__buildings__building__schools__'
+    points = []
+    for location, school_id, begin_year, end_year in AddressLocation.objects\
+            .filter(location__isnull=False, **{path + 'school__isnull': False})\
+            .values_list('location', path + 'school', path + 'begin_year', path + 'end_year').iterator():
+        points.append((school_id, location.x, location.y, begin_year, end_year))
+    return points
+
+
+class Grid(object):
+    """
+    The points grouped by the cells of a zoom level, with the clusters of all years.
+    """
+
+    def __init__(self, points, zoom):
+        self.size = 2 ** zoom * CELLS_PER_TILE
+        cells = defaultdict(list)
+        for point in points:
+            x, y = project(point[1], point[2])
+            cells[(self.cell(x), self.cell(y))].append(point)
+        self.keys = sorted(cells)
+        self.points = [cells[key] for key in self.keys]
+        self.clusters = [aggregate(cell) for cell in self.points]
+
+    def cell(self, value):
+        return min(int(value * self.size), self.size - 1)
+
+    def clusters_in(self, west, south, east, north, years=None):
+        """
+        Returns the clusters of the cells within the bounding box, restricted to the schools
+        located there during ``years`` if given as (from year, until year).
+        """
+        x0, y0 = [self.cell(value) for value in project(west, north)]
+        x1, y1 = [self.cell(value) for value in project(east, south)]
+        clusters = []
+        for i in range(bisect_left(self.keys, (x0, y0)), bisect_right(self.keys, (x1, y1))):
+            if not y0 <= self.keys[i][1] <= y1:
+                continue
+            if years is None:
+                cluster = self.clusters[i]
+            else:
+                cluster = aggregate([point for point in self.points[i] if overlaps(point[3], point[4], *years)])
+            if cluster is not None:
+                clusters.append(cluster)
+        return clusters
+
+
+class ClusterIndex(object):
+    """
+    The grids of the zoom levels for the current data version.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.points = []
+        self.grids = {}
+
+    def grid(self, zoom):
+        version = DataVersion.get(DataVersion.GLOBAL).version
+        with self.lock:
+            if version != self.version:
+                self.points, self.grids, self.version = load_points(), {}, version
+            if zoom not in self.grids:
+                self.grids[zoom] = Grid(self.points, zoom)
+            return self.grids[zoom]
+
+
+index = ClusterIndex()
@@ -0,0 +1,97 @@
+"""
+Stores the API representation of every school, so that the school endpoint
+can serve it without rendering the nested serializers.
+
+The documents are rendered with host relative hyperlinks, which are completed
+for the request serving them. Documents are refreshed whenever ``data_changed``
+reports changes to the schools. As the privacy window of employerships moves
+yearly, documents rendered in an earlier year are rendered again when served.
+"""
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from rest_framework.reverse import preserve_builtin_query_params
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import School, SchoolDocument
+from .prefetch import get_query_plan
+from .signals import data_changed
+
+# fields of the school representation holding hyperlinks to the API
+HYPERLINK_FIELDS = ('url', 'active_school', 'target_school')
+
+
+class RelativeURLRequest(object):
+    """
+    Stands in for the request when rendering documents, so that hyperlinks are rendered relative to the host.
+    """
+    GET = {}
+
+    def build_absolute_uri(self, location=None):
+        return location
+
+
+def render_documents(school_ids):
+    from .api import SchoolSerializer, censor, privacy_cutoff
+
+    context = {'request': RelativeURLRequest()}
+    refine = partial(censor, cutoff=privacy_cutoff())
+    schools = get_query_plan(SchoolSerializer).apply(School.objects.filter(id__in=school_ids), refine)
+    return [
+        SchoolDocument(school=school, data=json.dumps(SchoolSerializer(school, context=context).data, cls=JSONEncoder))
+        for school in schools
+    ]
+
+
+def store_documents(school_ids):
+    """
+    Renders and saves the documents of the given schools. Documents of removed schools are deleted.
+    """
+    school_ids = list(school_ids)
+    documents = render_documents(school_ids)
+    with transaction.atomic():
+        SchoolDocument.objects.filter(school_id__in=school_ids).delete()
+        SchoolDocument.objects.bulk_create(documents)
+    return documents
+
+
+def current_document(school):
+    """
+    Returns the stored document of ``school``, or None if it is missing or outdated.
+    """
+    document = getattr(school, 'document', None)
+    if document is None or document.modified_at.year < datetime.now().year:
+        return None
+    return document
+
+
+def _complete_hyperlinks(data, request):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in HYPERLINK_FIELDS and isinstance(value, str) and value.startswith('/'):
+                data[key] = preserve_builtin_query_params(request.build_absolute_uri(value), request)
+            else:
+                _complete_hyperlinks(value, request)
+    elif isinstance(data, list):
+        for value in data:
+            _complete_hyperlinks(value, request)
+
+
+def load_document(document, request):
+    """
+    Returns the stored representation with hyperlinks for the host of ``request``.
+    """
+    data = json.loads(document.data, object_pairs_hook=OrderedDict)
+    _complete_hyperlinks(data, request)
+    return data
+
+
+@receiver(data_changed, sender=School)
+def refresh_documents(sender, pks, **kwargs):
+    if settings.SCHOOL_DOCUMENT_STORE:
+        store_documents(pks)
@@ -0,0 +1,131 @@
+"""
+Matches kore addresses to munigeo addresses by the similarity of the street
+names, for addresses without an exact match.
+
+Street names are compared in their normalized form by the similarity of pg_trgm,
+the trigrams they share divided by the trigrams of either. The Finnish and Swedish names of the munigeo streets
+are indexed by trigram, so that only streets sharing trigrams with an address
+are compared. Addresses with the same street and municipality are matched
+together.
+"""
+import re
+from collections import Counter, defaultdict
+
+from munigeo.models import Address as MuniAddress, Street as MuniStreet
+
+from .text import normalize
+
+
+def split_street(street):
+    """
+    Splits the street name of a kore address into the street and the house number.
+    """
+    street_number = re.split('( [0-9]+)', street)
+    if len(street_number) > 1:
+        return street_number[0], street_number[1].strip()
+    return street_number[0], None
+
+
+def parse_number(value):
+    """
+    Returns the leading integer of a house number such as '5', '5 A' or '5-7', or None.
+    """
+    match = re.match(r'\s*(\d+)', value or '')
+    return int(match.group(1)) if match else None
+
+
+def trigrams(value):
+    grams = set()
+    for word in normalize(value).split():
+        word = '  ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class StreetIndex(object):
+    """
+    The munigeo streets searchable by name similarity, with their addresses by house number.
+    """
+    # confidence lost when the house number is only within the number range of an address
+    RANGE_PENALTY = 0.05
+
+    def __init__(self):
+        self.names = []
+        self.index = defaultdict(list)
+        self.municipalities = {}
+        self.addresses = defaultdict(list)
+
+    def load(self):
+        for street_id, name_fi, name_sv, municipality in MuniStreet.objects.values_list(
+                'id', 'name_fi', 'name_sv', 'municipality__name'):
+            self.municipalities[street_id] = municipality
+            for name in set(filter(None, (name_fi, name_sv))):
+                grams = trigrams(name)
+                for gram in grams:
+                    self.index[gram].append(len(self.names))
+                self.names.append((street_id, len(grams)))
+        for pk, street_id, number, number_end, modified_at in MuniAddress.objects.order_by('pk').values_list(
+                'pk', 'street', 'number', 'number_end', 'modified_at').iterator():
+            start = parse_number(number)
+            if start is not None:
+                end = parse_number(number_end) or start
+                self.addresses[street_id].append((start, end, pk))
+        return self
+
+    def similar_streets(self, street, municipality, min_similarity):
+        """
+        Returns (similarity, street id) of the streets in the municipality whose names are similar
+        to ``street``, the most similar first.
+        """
+        grams = trigrams(street)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.index.get(gram, ()))
+        similarities = {}
+        for i, count in shared.items():
+            street_id, gram_count = self.names[i]
+            if self.municipalities[street_id] != municipality:
+                continue
+            similarity = float(count) / (len(grams) + gram_count - count)
+            if similarity >= min_similarity and similarity > similarities.get(street_id, 0):
+                similarities[street_id] = similarity
+        return sorted(((similarity, street_id) for street_id, similarity in similarities.items()), reverse=True)
+
+    def find_address(self, street_id, number):
+        """
+        Returns the munigeo address with the house number, or covering it with its number range,
+        and whether the number was matched exactly.
+        """
+        covering = None
+        for start, end, pk in self.addresses.get(street_id, ()):
+            if start == number:
+                return pk, True
+            if covering is None and start <= number <= end:
+                covering = pk
+        return covering, False
+
+    def match_all(self, addresses, min_confidence):
+        """
+        Matches the (key, streets, number, municipality) items of ``addresses``, where streets
+        are the alternative names of the street. Returns (munigeo address id, confidence) by key.
+        """
+        groups = defaultdict(list)
+        for key, streets, number, municipality in addresses:
+            number = parse_number(number)
+            if number is not None:
+                groups[(tuple(streets), municipality)].append((key, number))
+        matches = {}
+        for (streets, municipality), items in groups.items():
+            candidates = sorted((candidate for street in streets
+                                 for candidate in self.similar_streets(street, municipality, min_confidence)),
+                                reverse=True)
+            for key, number in items:
+                for similarity, street_id in candidates:
+                    pk, exact = self.find_address(street_id, number)
+                    confidence = similarity if exact else similarity - self.RANGE_PENALTY
+                    if pk is not None and confidence >= min_confidence:
+                        matches[key] = (pk, confidence)
+                        break
+        return matches
@@ -1,54 +1,145 @@
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max
 from schools.models import *
+from schools.geocoding import StreetIndex, split_street
+from schools.signals import notify_changed
 from munigeo.models import Address as MuniAddress
-import re
+import hashlib
+import time
 from optparse import make_option
 
 
+def fingerprint(*values):
+    return hashlib.sha1('\n'.join(str(value) for value in values).encode('utf-8')).hexdigest()
+
+
 class Command(BaseCommand):
-    help = 'Geocodes all addresses in Address.objects'
+    help = 'Geocodes the addresses in Address.objects whose text or reference data has changed'
     option_list = BaseCommand.option_list + (
         make_option('--rewrite-existing',
                     action='store_true',
                     dest='rewrite_existing',
                     default=False,
                     help='Rewrites all automatically geocoded addresses'),
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=1000,
+                    help='Number of addresses written and committed at a time'),
+        make_option('--min-confidence',
+                    type='float',
+                    dest='min_confidence',
+                    default=0.45,
+                    help='Lowest street name similarity accepted for addresses without an exact match'),
     )
 
+    def load_reference(self):
+        """
+        Returns the munigeo address ids and versions by street, number and municipality, keeping
+        the first of duplicates, and the version of the whole munigeo address data.
+        """
+        reference = {}
+        for pk, street, number, municipality, modified_at in MuniAddress.objects.order_by('pk').values_list(
+                'pk', 'street__name', 'number', 'street__municipality__name', 'modified_at').iterator():
+            reference.setdefault((street, number, municipality), (pk, '%s:%s' % (pk, modified_at)))
+        stats = MuniAddress.objects.aggregate(count=Count('pk'), modified_at=Max('modified_at'))
+        return reference, fingerprint(stats['count'], stats['modified_at'])
+
     def handle(self, *args, **options):
-        for address in Address.objects.all():
-            if hasattr(address, 'location'):
-                location = address.location
-            else:
-                location = AddressLocation(address=address, handmade=False)
+        started = time.time()
+        reference, reference_version = self.load_reference()
+        self.stdout.write('%d reference addresses loaded' % len(reference))
 
+        locations = dict(
+            (address_id, (handmade, source_fingerprint, version)) for address_id, handmade, source_fingerprint, version
+            in AddressLocation.objects.values_list('address', 'handmade', 'source_fingerprint', 'reference_version')
+        )
+
+        # the results of fuzzy matching depend on all the reference data
+        fuzzy_version = 'fuzzy:%s:%s' % (reference_version, options['min_confidence'])
+        examined, pending, unmatched = 0, [], []
+        for address_id, street, street_sv, municipality in Address.objects.order_by('id')\
+                .values_list('id', 'street_name_fi', 'street_name_sv', 'municipality_fi'):
+            examined += 1
+            handmade, old_fingerprint, old_version = locations.get(address_id, (False, None, None))
             # Skip all manually geocoded locations
-            if location.handmade:
+            if handmade:
                 continue
-
-            if location.location is not None and not options['rewrite_existing']:
+            street_name, number = split_street(street)
+            match = reference.get((street_name, number, municipality)) if number is not None else None
+            version = match[1] if match is not None else fuzzy_version
+            source_fingerprint = fingerprint(street, street_sv, municipality)
+            if (not options['rewrite_existing'] and
+                    old_fingerprint == source_fingerprint and old_version == version):
                 continue
-
-            address_street, town = str(address).split(', ')
-            address_street_number = re.split('( [0-9]+)', address_street)
-            address_street = address_street_number[0]
-            if len(address_street_number) > 1:
-                address_number = address_street_number[1].strip()
+            if match is not None:
+                pending.append((address_id, match[0], 1.0, source_fingerprint, version))
             else:
-                address_number = None
+                streets = [street_name] + ([split_street(street_sv)[0]] if street_sv else [])
+                unmatched.append((address_id, streets, number, municipality, source_fingerprint))
 
-            if address_number is not None:
-                match = MuniAddress.objects.filter(
-                    street__name=address_street, number=address_number,
-                    street__municipality__name=town
-                ).first()
-            else:
-                match = None
+        exact = len(pending)
+        self.stdout.write('%d exact matches, matching %d addresses by street similarity' % (exact, len(unmatched)))
+        street_index = StreetIndex().load()
+        fuzzy = street_index.match_all([item[:4] for item in unmatched], options['min_confidence'])
+        for address_id, streets, number, municipality, source_fingerprint in unmatched:
+            match_id, confidence = fuzzy.get(address_id, (None, None))
+            pending.append((address_id, match_id, confidence, source_fingerprint, fuzzy_version))
+            if options['verbosity'] > 1:
+                self.stdout.write('%s %s, %s %s' % (streets[0], number, municipality,
+                                                    'geocoded' if match_id else 'match not found'))
 
-            if match is not None:
-                self.stdout.write(str(address) + ' geocoded as ' + str(match))
-                location.location = match.location
-            else:
-                location.location = None
-                self.stdout.write(str(address) + ' match not found')
-            location.save()
+        # every batch is committed along with the fingerprints, so an interrupted run
+        # continues from the first batch not written
+        batch_size = options['batch_size']
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            with transaction.atomic():
+                AddressLocation.objects.bulk_create([
+                    AddressLocation(address_id=item[0], handmade=False) for item in batch if item[0] not in locations
+                ])
+                self.write_locations(batch)
+                notify_changed(AddressLocation, AddressLocation.objects.filter(address__in=[item[0] for item in batch])
+                               .values_list('id', flat=True))
+            self.stdout.write('%d/%d addresses written' % (i + len(batch), len(pending)))
+
+        elapsed = time.time() - started
+        matched = sum(1 for item in pending if item[1] is not None)
+        self.stdout.write('%d addresses examined, %d geocoded, %d unchanged or handmade' % (
+            examined, len(pending), examined - len(pending)))
+        if pending:
+            self.stdout.write('%d matches found (%.1f %%), %d exact and %d by street similarity, %d not found' % (
+                matched, 100.0 * matched / len(pending), exact, matched - exact, len(pending) - matched))
+        self.stdout.write('%.1f s, %.0f addresses per second' % (elapsed, examined / elapsed if elapsed else 0))
+
+    def write_locations(self, items):
+        """
+        Copies the locations of the matched munigeo addresses, given as (address id, munigeo
+        address id or None, confidence, source fingerprint, reference version).
+        """
+        qn = connection.ops.quote_name
+        location_field = AddressLocation._meta.get_field('location')
+        sql = (
+            'UPDATE {locations} SET {location} = ST_Transform(reference.{reference_location}, {srid}), '
+            '{confidence} = matches.confidence, {source_fingerprint} = matches.source_fingerprint, '
+            '{reference_version} = matches.reference_version '
+            'FROM (VALUES {values}) '
+            'AS matches (address_id, reference_id, confidence, source_fingerprint, reference_version) '
+            'LEFT JOIN {reference} reference ON reference.{reference_pk} = matches.reference_id '
+            'WHERE {locations}.{address} = matches.address_id'
+        ).format(
+            locations=qn(AddressLocation._meta.db_table),
+            location=qn(location_field.column),
+            srid=location_field.srid,
+            confidence=qn(AddressLocation._meta.get_field('confidence').column),
+            source_fingerprint=qn(AddressLocation._meta.get_field('source_fingerprint').column),
+            reference_version=qn(AddressLocation._meta.get_field('reference_version').column),
+            reference=qn(MuniAddress._meta.db_table),
+            reference_location=qn(MuniAddress._meta.get_field('location').column),
+            reference_pk=qn(MuniAddress._meta.pk.column),
+            address=qn(AddressLocation._meta.get_field('address').column),
+            values=', '.join(['(%s, %s::integer, %s::double precision, %s, %s)'] * len(items)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for item in items for value in item])
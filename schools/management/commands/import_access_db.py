@@ -0,0 +1,93 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from schools.access import (copy_table, create_fake_primary_keys, list_tables, read_columns, read_schema,
+                            record_row_hashes)
+from schools.models import IncrementalIDKoreModel, SourceRowHash
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import time
+
+
+def load_table(args):
+    path, table = args
+    return (table,) + copy_table(path, table)
+
+
+class Command(BaseCommand):
+    args = '<access file>'
+    help = ('Loads the tables of the original Access database into an empty database. '
+            'Run it again with --record-hashes once the database is migrated, so that sync_access_db '
+            'can find the rows changed in later versions of the Access database')
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    type='int',
+                    dest='processes',
+                    default=cpu_count(),
+                    help='Number of worker processes loading tables'),
+        make_option('--record-hashes',
+                    action='store_true',
+                    dest='record_hashes',
+                    default=False,
+                    help='Only record the hashes of the rows of the loaded tables, after migrate'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of the Access database file')
+        path = args[0]
+        started = time.time()
+
+        if options['record_hashes']:
+            existing = set(connection.introspection.table_names())
+            if SourceRowHash._meta.db_table not in existing:
+                raise CommandError('Run migrate before recording the row hashes')
+            tables = [table for table in list_tables(path) if table in existing]
+            self.record_hashes(tables, dict((table, read_columns(path, table)) for table in tables))
+            self.stdout.write('row hashes recorded, %.1f s' % (time.time() - started))
+            return
+
+        tables = list_tables(path)
+        create_tables, create_constraints = read_schema(path)
+        with connection.cursor() as cursor:
+            cursor.execute(create_tables)
+        self.stdout.write('%d tables created' % len(tables))
+
+        # the workers must open database connections of their own
+        connections.close_all()
+        pool = Pool(options['processes'])
+        columns = {}
+        try:
+            for table, table_columns, rows in pool.imap_unordered(load_table, [(path, table) for table in tables]):
+                columns[table] = table_columns
+                self.stdout.write('%d/%d %s: %d rows' % (len(columns), len(tables), table, rows))
+        finally:
+            pool.close()
+            pool.join()
+
+        # building the indexes once is much faster than updating them on every row
+        with connection.cursor() as cursor:
+            cursor.execute(create_constraints)
+        self.stdout.write('constraints and indexes created')
+
+        changed = create_fake_primary_keys(tables)
+        self.stdout.write('fake primary keys created for %d tables' % len(changed))
+
+        with connection.cursor() as cursor:
+            for model in apps.get_app_config('schools').get_models():
+                if issubclass(model, IncrementalIDKoreModel):
+                    cursor.execute('CREATE SEQUENCE IF NOT EXISTS %s' % model.id_sequence())
+                    model.sync_id_sequence()
+        self.stdout.write('id sequences updated')
+
+        # the hashes of the rows are compared by sync_access_db to find the changed rows
+        if SourceRowHash._meta.db_table not in connection.introspection.table_names():
+            self.stdout.write('row hashes not recorded, run again with --record-hashes after migrate')
+            return
+        self.record_hashes(tables, columns)
+        self.stdout.write('row hashes recorded, %.1f s' % (time.time() - started))
+
+    def record_hashes(self, tables, columns):
+        for table in tables:
+            if not record_row_hashes(table, columns[table]):
+                self.stdout.write('%s has no primary key, it cannot be synced' % table)
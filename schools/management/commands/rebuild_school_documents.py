@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from schools.models import School, SchoolDocument
+from schools.documents import store_documents
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+
+def rebuild_chunk(school_ids):
+    return len(store_documents(school_ids))
+
+
+class Command(BaseCommand):
+    help = 'Renders the stored documents of all schools'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    type='int',
+                    dest='processes',
+                    default=cpu_count(),
+                    help='Number of worker processes rendering documents'),
+        make_option('--chunk-size',
+                    type='int',
+                    dest='chunk_size',
+                    default=100,
+                    help='Number of schools rendered at a time by a worker'),
+    )
+
+    def handle(self, *args, **options):
+        school_ids = list(School.objects.order_by('id').values_list('id', flat=True))
+        SchoolDocument.objects.exclude(school_id__in=school_ids).delete()
+
+        chunk_size = options['chunk_size']
+        chunks = [school_ids[i:i + chunk_size] for i in range(0, len(school_ids), chunk_size)]
+        # the workers must open database connections of their own
+        connections.close_all()
+        pool = Pool(options['processes'])
+        rendered = 0
+        try:
+            for count in pool.imap_unordered(rebuild_chunk, chunks):
+                rendered += count
+                self.stdout.write('%d/%d documents rendered' % (rendered, len(school_ids)))
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from schools.models import *
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the cached names, search terms and data versions of all schools and buildings'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size',
+                    type='int',
+                    dest='chunk_size',
+                    default=1000,
+                    help='Number of objects refreshed at a time'),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        school_ids = list(School.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(school_ids), chunk_size):
+            SchoolOfficialName.refresh(school_ids[i:i + chunk_size])
+            SchoolSearchTerm.refresh(school_ids[i:i + chunk_size])
+        self.stdout.write('%d school names and search terms refreshed' % len(school_ids))
+
+        building_ids = list(Building.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(building_ids), chunk_size):
+            BuildingLabel.refresh(building_ids[i:i + chunk_size])
+        self.stdout.write('%d building labels refreshed' % len(building_ids))
+
+        # the data may have been loaded from outside Django, so cached responses are outdated
+        DataVersion.bump([DataVersion.GLOBAL] +
+                         [DataVersion.key_for(School, pk) for pk in school_ids] +
+                         [DataVersion.key_for(Building, pk) for pk in building_ids])
+        self.stdout.write('data versions bumped')
@@ -0,0 +1,58 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from schools.access import TableSync, list_tables, table_order
+from schools.models import IncrementalIDKoreModel
+from schools.signals import delete_in_bulk, notify_changed
+import time
+
+
+class Command(BaseCommand):
+    args = '<access file>'
+    help = 'Writes the rows changed in a new version of the Access database since it was last imported or synced'
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of the Access database file')
+        path = args[0]
+        started = time.time()
+
+        existing = set(connection.introspection.table_names())
+        tables = [table for table in list_tables(path) if table in existing]
+        models = dict((model._meta.db_table, model) for model in apps.get_app_config('schools').get_models()
+                      if model._meta.db_table in tables)
+
+        with transaction.atomic():
+            syncs = []
+            for table in table_order(tables):
+                sync = TableSync(path, table)
+                if not sync.stage():
+                    self.stdout.write('%s has no primary key, skipped' % table)
+                    continue
+                syncs.append(sync)
+                self.stdout.write('%s: %d new or changed rows, %d deleted' % (table, sync.upserted, sync.deleted))
+
+            # rows are written after the rows they refer to, and deleted before them
+            for sync in syncs:
+                model = models.get(sync.table)
+                pks = sync.upsert(model._meta.pk.column if model else None)
+                if model is not None and pks:
+                    notify_changed(model, pks)
+            for sync in reversed(syncs):
+                model = models.get(sync.table)
+                if model is None:
+                    sync.delete()
+                    continue
+                # deleted through the models, so that the rows of Django tables referring to them go too
+                pks = sync.deleted_pks(model._meta.pk.column)
+                for i in range(0, len(pks), 1000):
+                    delete_in_bulk(model._base_manager.filter(pk__in=pks[i:i + 1000]))
+            for sync in syncs:
+                sync.record()
+
+            for model in models.values():
+                if issubclass(model, IncrementalIDKoreModel):
+                    model.sync_id_sequence()
+
+        self.stdout.write('%d rows written, %d deleted, %.1f s' % (
+            sum(sync.upserted for sync in syncs), sum(sync.deleted for sync in syncs), time.time() - started))
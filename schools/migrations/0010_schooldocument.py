@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0009_auto_20150605_0745'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchoolDocument',
+            fields=[
+                ('school', models.OneToOneField(serialize=False, primary_key=True, related_name='document', db_constraint=False, to='schools.School')),
+                ('data', models.TextField()),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0010_schooldocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchoolOfficialName',
+            fields=[
+                ('school', models.OneToOneField(serialize=False, primary_key=True, related_name='official_name', db_constraint=False, to='schools.School')),
+                ('value', models.CharField(max_length=510, null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0011_schoolofficialname'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildingLabel',
+            fields=[
+                ('building', models.OneToOneField(serialize=False, primary_key=True, related_name='label', db_constraint=False, to='schools.Building')),
+                ('value', models.CharField(max_length=1030)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# "Tyosuhde" is not managed by Django, so the indexes are only created where the table exists
+CREATE_INDEXES = '''
+DO $$
+BEGIN
+    IF to_regclass('"Tyosuhde"') IS NOT NULL THEN
+        CREATE INDEX "Tyosuhde_paattymisvuosi" ON "Tyosuhde" ("paattymisvuosi");
+        CREATE INDEX "Tyosuhde_koulun_id_paattymisvuosi" ON "Tyosuhde" ("koulun_id", "paattymisvuosi");
+        CREATE INDEX "Tyosuhde_rehtorin_id_paattymisvuosi" ON "Tyosuhde" ("rehtorin_id", "paattymisvuosi");
+    END IF;
+END
+$$;
+'''
+
+DROP_INDEXES = '''
+DROP INDEX IF EXISTS "Tyosuhde_paattymisvuosi";
+DROP INDEX IF EXISTS "Tyosuhde_koulun_id_paattymisvuosi";
+DROP INDEX IF EXISTS "Tyosuhde_rehtorin_id_paattymisvuosi";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0012_buildinglabel'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
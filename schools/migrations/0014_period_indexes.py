@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# The periods of the temporal tables are ranges of years, with open ends unbounded.
+# Inverted periods of the legacy data are swapped, as ranges cannot be inverted.
+CREATE_FUNCTION = '''
+CREATE OR REPLACE FUNCTION kore_year_range(begin_year integer, end_year integer) RETURNS int4range AS $$
+    SELECT CASE WHEN begin_year > end_year THEN int4range(end_year, begin_year, '[]')
+                ELSE int4range(begin_year, end_year, '[]') END
+$$ LANGUAGE sql IMMUTABLE;
+'''
+
+DROP_FUNCTION = 'DROP FUNCTION IF EXISTS kore_year_range(integer, integer);'
+
+# the tables are not managed by Django, so the indexes are only created where the tables exist
+CREATE_INDEXES = '''
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['Nimi', 'Tyosuhde', 'Rakennuksen_status'] LOOP
+        IF to_regclass(quote_ident(t)) IS NOT NULL THEN
+            EXECUTE format('CREATE INDEX %I ON %I USING gist (kore_year_range(alkamisvuosi, paattymisvuosi))',
+                           t || '_vuodet', t);
+        END IF;
+    END LOOP;
+END
+$$;
+'''
+
+DROP_INDEXES = '''
+DROP INDEX IF EXISTS "Nimi_vuodet";
+DROP INDEX IF EXISTS "Tyosuhde_vuodet";
+DROP INDEX IF EXISTS "Rakennuksen_status_vuodet";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0013_employership_end_year_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FUNCTION, DROP_FUNCTION),
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
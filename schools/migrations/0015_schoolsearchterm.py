@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# the expressions must match the ones used in schools.search
+CREATE_INDEXES = '''
+CREATE INDEX "schools_schoolsearchterm_value_trgm" ON "schools_schoolsearchterm" USING gin ("value" gin_trgm_ops);
+CREATE INDEX "schools_schoolsearchterm_value_fts" ON "schools_schoolsearchterm" USING gin (to_tsvector('simple', "value"));
+'''
+
+DROP_INDEXES = '''
+DROP INDEX IF EXISTS "schools_schoolsearchterm_value_trgm";
+DROP INDEX IF EXISTS "schools_schoolsearchterm_value_fts";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0014_period_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL('CREATE EXTENSION IF NOT EXISTS pg_trgm;', migrations.RunSQL.noop),
+        migrations.CreateModel(
+            name='SchoolSearchTerm',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, primary_key=True, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('school', models.ForeignKey(related_name='search_terms', db_constraint=False, to='schools.School')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
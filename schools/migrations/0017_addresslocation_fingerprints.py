@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0016_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addresslocation',
+            name='source_fingerprint',
+            field=models.CharField(max_length=40, blank=True, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='addresslocation',
+            name='reference_version',
+            field=models.CharField(max_length=100, blank=True, editable=False),
+            preserve_default=True,
+        ),
+    ]
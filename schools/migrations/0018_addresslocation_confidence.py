@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0017_addresslocation_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addresslocation',
+            name='confidence',
+            field=models.FloatField(null=True, blank=True, editable=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# The geometry column already has the spatial index created by GeoDjango, which serves
+# bounding box queries. Distances in metres are computed on the geography, which needs
+# an index of its own for radius queries.
+CREATE_INDEX = '''
+CREATE INDEX schools_addresslocation_location_geography
+    ON schools_addresslocation USING gist ((location::geography));
+'''
+
+DROP_INDEX = 'DROP INDEX IF EXISTS schools_addresslocation_location_geography;'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0018_addresslocation_confidence'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# The ids of the tables of IncrementalIDKoreModel are allocated from these sequences,
+# starting after the largest existing id. The tables are not managed by Django, so the
+# sequences are only created where the tables exist.
+CREATE_SEQUENCES = '''
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['Arkistoaineisto', 'Koulu', 'Nimen_tyyppi', 'Nimi', 'Osoite', 'Rakennuksen_nimi',
+                             'Rakennus', 'Rehtori', 'Tyosuhde'] LOOP
+        IF to_regclass(quote_ident(t)) IS NOT NULL THEN
+            EXECUTE format('CREATE SEQUENCE IF NOT EXISTS %I', t || '_ID_seq');
+            EXECUTE format('SELECT setval(%L, coalesce(max("ID"), 0) + 1, false) FROM %I',
+                           quote_ident(t || '_ID_seq'), t);
+        END IF;
+    END LOOP;
+END
+$$;
+'''
+
+DROP_SEQUENCES = '''
+DROP SEQUENCE IF EXISTS "Arkistoaineisto_ID_seq";
+DROP SEQUENCE IF EXISTS "Koulu_ID_seq";
+DROP SEQUENCE IF EXISTS "Nimen_tyyppi_ID_seq";
+DROP SEQUENCE IF EXISTS "Nimi_ID_seq";
+DROP SEQUENCE IF EXISTS "Osoite_ID_seq";
+DROP SEQUENCE IF EXISTS "Rakennuksen_nimi_ID_seq";
+DROP SEQUENCE IF EXISTS "Rakennus_ID_seq";
+DROP SEQUENCE IF EXISTS "Rehtori_ID_seq";
+DROP SEQUENCE IF EXISTS "Tyosuhde_ID_seq";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0019_addresslocation_geography_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEQUENCES, DROP_SEQUENCES),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0020_id_sequences'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceRowHash',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('table_name', models.CharField(max_length=100)),
+                ('row_key', models.TextField()),
+                ('row_hash', models.CharField(max_length=32)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sourcerowhash',
+            unique_together=set([('table_name', 'row_key')]),
+        ),
+    ]
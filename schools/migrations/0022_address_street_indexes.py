@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# The address locations are listed in the order of the streets, with the schools at each
+# address. The tables are not managed by Django, so the indexes are only created where
+# the tables exist.
+CREATE_INDEXES = '''
+DO $$
+BEGIN
+    IF to_regclass('"Osoite"') IS NOT NULL THEN
+        CREATE INDEX "Osoite_kadun_nimi_suomeksi" ON "Osoite" ("kadun_nimi_suomeksi");
+    END IF;
+    IF to_regclass('"Rakennuksen_osoite"') IS NOT NULL THEN
+        CREATE INDEX "Rakennuksen_osoite_osoitteen_id" ON "Rakennuksen_osoite" ("osoitteen_id");
+    END IF;
+    IF to_regclass('"Rakennuksen_status"') IS NOT NULL THEN
+        CREATE INDEX "Rakennuksen_status_rakennuksen_id" ON "Rakennuksen_status" ("rakennuksen_id");
+    END IF;
+END
+$$;
+'''
+
+DROP_INDEXES = '''
+DROP INDEX IF EXISTS "Osoite_kadun_nimi_suomeksi";
+DROP INDEX IF EXISTS "Rakennuksen_osoite_osoitteen_id";
+DROP INDEX IF EXISTS "Rakennuksen_status_rakennuksen_id";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0021_sourcerowhash'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import models, migrations
+
+from schools.text import normalize
+
+# The relations of the tables of the original Access database are not in the migration
+# state, so they are read with SQL, in the orders used by the refresh methods of the models.
+NAMES_SQL = '''
+SELECT n.koulun_id, t.nimen_tyyppi, t.nimi FROM "Nimen_tyyppi" t JOIN "Nimi" n ON n."ID" = t.nimen_id
+WHERE n.koulun_id IS NOT NULL ORDER BY n.koulun_id, n.alkamisvuosi DESC
+'''
+
+STREETS_SQL = '''
+SELECT r.rakennuksen_id, o.kadun_nimi_suomeksi FROM "Rakennuksen_osoite" r JOIN "Osoite" o ON o."ID" = r.osoitteen_id
+ORDER BY r.rakennuksen_id, o.alkamisvuosi DESC
+'''
+
+BUILDING_NAMES_SQL = '''
+SELECT rakennuksen_id, nimi FROM "Rakennuksen_nimi" WHERE rakennuksen_id IS NOT NULL
+ORDER BY rakennuksen_id, alkamisvuosi DESC
+'''
+
+
+def fill_derived_tables(apps, schema_editor):
+    """
+    Fills the official names, search terms and building labels derived from the tables of the
+    original Access database, which are otherwise only refreshed on saves. The tables are not
+    managed by Django, so nothing is filled where they do not exist.
+    """
+    SchoolOfficialName = apps.get_model('schools', 'SchoolOfficialName')
+    SchoolSearchTerm = apps.get_model('schools', 'SchoolSearchTerm')
+    BuildingLabel = apps.get_model('schools', 'BuildingLabel')
+    connection = schema_editor.connection
+    tables = set(connection.introspection.table_names())
+
+    with connection.cursor() as cursor:
+        if {'Koulu', 'Nimi', 'Nimen_tyyppi'} <= tables:
+            names, terms = {}, set()
+            cursor.execute(NAMES_SQL)
+            for school_id, name_type, value in cursor.fetchall():
+                if name_type == 'virallinen nimi':
+                    names.setdefault(school_id, value)
+                terms.add((school_id, normalize(value or '')))
+            cursor.execute('SELECT "ID", lempinimet FROM "Koulu"')
+            schools = cursor.fetchall()
+            for school_id, nicknames in schools:
+                terms.update((school_id, normalize(value)) for value in re.split(r'[,;]', nicknames or ''))
+            SchoolOfficialName.objects.all().delete()
+            SchoolOfficialName.objects.bulk_create(
+                [SchoolOfficialName(school_id=school_id, value=names.get(school_id)) for school_id, _ in schools],
+                batch_size=1000)
+            SchoolSearchTerm.objects.all().delete()
+            SchoolSearchTerm.objects.bulk_create(
+                [SchoolSearchTerm(school_id=school_id, value=value) for school_id, value in sorted(terms) if value],
+                batch_size=1000)
+
+        if {'Rakennus', 'Rakennuksen_osoite', 'Osoite', 'Rakennuksen_nimi'} <= tables:
+            streets, names = {}, {}
+            cursor.execute(STREETS_SQL)
+            for building_id, street in cursor.fetchall():
+                streets.setdefault(building_id, street)
+            cursor.execute(BUILDING_NAMES_SQL)
+            for building_id, name in cursor.fetchall():
+                names.setdefault(building_id, name)
+            labels = []
+            cursor.execute('SELECT "ID" FROM "Rakennus"')
+            for building_id, in cursor.fetchall():
+                label = streets.get(building_id) or '<no address>'
+                if building_id in names:
+                    label += ' (%s)' % names[building_id]
+                labels.append(BuildingLabel(building_id=building_id, value=label))
+            BuildingLabel.objects.all().delete()
+            BuildingLabel.objects.bulk_create(labels, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schools', '0022_address_street_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_derived_tables, migrations.RunPython.noop),
+    ]
@@ -1,21 +1,65 @@
 from __future__ import unicode_literals
 
+import re
+
 from django.contrib.gis.db import models
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
 from munigeo.models import Address as Location
 from django.utils.translation import ugettext_lazy as _
 
+from .text import normalize
+
 
 class IncrementalIDKoreModel(models.Model):
     """
-    Needed as Django Autofield doesn't work with an existing database.
+    Needed as Django Autofield doesn't work with an existing database. The ids are allocated
+    from a sequence of each table, created in the migrations, so that concurrent saves never
+    get the same id.
     """
 
-    def save(self, **kwargs):
+    @classmethod
+    def id_sequence(cls):
+        return connection.ops.quote_name('%s_%s_seq' % (cls._meta.db_table, cls._meta.pk.column))
+
+    @classmethod
+    def allocate_ids(cls, count=1):
+        """
+        Reserves ``count`` new ids and returns them in ascending order.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [cls.id_sequence(), count])
+            return sorted(row[0] for row in cursor.fetchall())
+
+    @classmethod
+    def assign_ids(cls, instances):
+        """
+        Gives ids to the instances without one, so that they can be saved with bulk_create.
+        """
+        instances = list(instances)
+        new = [instance for instance in instances if not instance.id]
+        if new:
+            for instance, pk in zip(new, cls.allocate_ids(len(new))):
+                instance.id = pk
+        return instances
+
+    @classmethod
+    def sync_id_sequence(cls):
+        """
+        Moves the sequence past the ids written without it, e.g. by imports of the original database.
+        """
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT setval(%s, GREATEST((SELECT coalesce(max({pk}), 0) FROM {table}), '
+                           '(SELECT last_value FROM {sequence})))'.format(
+                               pk=qn(cls._meta.pk.column), table=qn(cls._meta.db_table), sequence=cls.id_sequence()),
+                           [cls.id_sequence()])
+
+    def save(self, *args, **kwargs):
         if not self.id:
-            print(self.__class__)
-            self.id = self.__class__.objects.all().aggregate(models.Max('id'))['id__max']+1
-            print(self.id)
-        return super().save(kwargs)
+            self.id = self.allocate_ids()[0]
+        return super().save(*args, **kwargs)
 
     class Meta:
         managed = False
@@ -142,6 +186,14 @@ class Language(models.Model):
         db_table = 'Kieli'
 
 
+class SchoolQuerySet(models.QuerySet):
+    def with_official_name(self):
+        """
+        Fetches the cached official names, so that __str__ runs no queries.
+        """
+        return self.select_related('official_name')
+
+
 class School(IncrementalIDKoreModel):
     id = models.AutoField(db_column='ID', primary_key=True)
     special_features = models.TextField(blank=True, db_column='erityispiirteet')
@@ -149,14 +201,25 @@ class School(IncrementalIDKoreModel):
     nicknames = models.CharField(max_length=510, blank=True, db_column='lempinimet', verbose_name=_('nicknames'))
     checked = models.BooleanField(default=False, db_column='tarkastettu')
 
-    def __str__(self):
+    objects = SchoolQuerySet.as_manager()
+
+    def get_official_name(self):
         types = NameType.objects.filter(name__school=self).order_by('-name__begin_year')\
             .filter(type='virallinen nimi')
         if not types:
-            return '<no name>'
+            return None
         else:
             return types[0].value
 
+    def __str__(self):
+        try:
+            name = self.official_name.value
+        except SchoolOfficialName.DoesNotExist:
+            name = self.get_official_name()
+        if name is None:
+            return '<no name>'
+        return name
+
     @staticmethod
     def autocomplete_search_fields():
         return ("names__types__value__icontains",)
@@ -189,7 +252,7 @@ class SchoolField(models.Model):
         # the main school id must be set to the school id unless provided otherwise
         if not self.main_school_id:
             self.main_school_id = self.school_id
-        return super().save(kwargs)
+        return super().save(**kwargs)
 
     class Meta:
         managed = False
@@ -234,7 +297,7 @@ class SchoolType(models.Model):
         # the main school id must be set to the school id unless provided otherwise
         if not self.main_school_id:
             self.main_school_id = self.school_id
-        return super().save(kwargs)
+        return super().save(**kwargs)
 
     class Meta:
         managed = False
@@ -468,6 +531,18 @@ class BuildingAddress(models.Model):
         verbose_name_plural = _('building addresses')
 
 
+class SchoolBuildingQuerySet(models.QuerySet):
+    def with_photo_flag(self):
+        """
+        Finds out whether each school building has photos in the same query, so that has_photo runs no queries.
+        """
+        qn = connection.ops.quote_name
+        photos = qn(SchoolBuildingPhoto._meta.db_table)
+        return self.extra(select={'photo_exists': 'EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s)' % (
+            photos, photos, qn(SchoolBuildingPhoto._meta.get_field('school_building').column),
+            qn(self.model._meta.db_table), qn(self.model._meta.pk.column))})
+
+
 class SchoolBuilding(models.Model):
     id = models.CharField(max_length=100, primary_key=True)
     school = models.ForeignKey(School, related_name='buildings', db_column='koulun_id')
@@ -494,14 +569,18 @@ class SchoolBuilding(models.Model):
 
         return "%s / %s (%s)" % (self.school, self.building, s)
 
+    objects = SchoolBuildingQuerySet.as_manager()
+
     def has_photo(self):
-        return bool(self.photos.all())
+        if hasattr(self, 'photo_exists'):
+            return self.photo_exists
+        return self.photos.exists()
     has_photo.boolean = True
 
     def save(self, **kwargs):
         if not self.id:
             self.id = str(self.school_id) + '-' + str(self.building_id)
-        return super().save(kwargs)
+        return super().save(**kwargs)
 
     class Meta:
         managed = False
@@ -511,6 +590,14 @@ class SchoolBuilding(models.Model):
         verbose_name_plural = _('school buildings')
 
 
+class BuildingQuerySet(models.QuerySet):
+    def with_label(self):
+        """
+        Fetches the cached labels, so that __str__ runs no queries.
+        """
+        return self.select_related('label')
+
+
 class Building(IncrementalIDKoreModel):
     id = models.IntegerField(db_column='ID', primary_key=True)
     neighborhood = models.ForeignKey(Neighborhood, blank=True, null=True, db_column='kaupunginosan_id', verbose_name=_('neighborhood'))
@@ -525,7 +612,9 @@ class Building(IncrementalIDKoreModel):
     approx = models.BooleanField(default=False, db_column='noin')
     addresses = models.ManyToManyField(Address, through=BuildingAddress)
 
-    def __str__(self):
+    objects = BuildingQuerySet.as_manager()
+
+    def get_label(self):
         addresses = self.addresses.order_by('-begin_year')
         s = None
         if addresses:
@@ -537,6 +626,12 @@ class Building(IncrementalIDKoreModel):
             s += ' (%s)' % names[0].name
         return s
 
+    def __str__(self):
+        try:
+            return self.label.value
+        except BuildingLabel.DoesNotExist:
+            return self.get_label()
+
     def get_photos(self):
         photos = []
         for school_building in self.schools.all():
@@ -620,21 +715,53 @@ class ArchiveDataLink(models.Model):
         verbose_name_plural = _('archive data link')
 
 
+class AddressLocationQuerySet(models.GeoQuerySet):
+    def with_school_names(self):
+        """
+        Fetches the addresses and the cached official names of the schools at them in the same
+        query, so that __str__ runs no queries.
+        """
+        qn = connection.ops.quote_name
+        names, school_building, building_address = [qn(model._meta.db_table) for model in (
+            SchoolOfficialName, SchoolBuilding, BuildingAddress)]
+        sql = ("SELECT string_agg({names}.{value}, ', ' ORDER BY {names}.{value}) FROM {names} "
+               "JOIN {school_building} ON {school_building}.{school} = {names}.{names_school} "
+               "JOIN {building_address} ON {building_address}.{building} = {school_building}.{school_building_building} "
+               "WHERE {building_address}.{address} = {locations}.{location_address}").format(
+            names=names, value=qn(SchoolOfficialName._meta.get_field('value').column),
+            names_school=qn(SchoolOfficialName._meta.get_field('school').column),
+            school_building=school_building, school=qn(SchoolBuilding._meta.get_field('school').column),
+            school_building_building=qn(SchoolBuilding._meta.get_field('building').column),
+            building_address=building_address, building=qn(BuildingAddress._meta.get_field('building').column),
+            address=qn(BuildingAddress._meta.get_field('address').column),
+            locations=qn(self.model._meta.db_table), location_address=qn(self.model._meta.get_field('address').column))
+        return self.select_related('address').extra(select={'school_names': sql})
+
+
 class AddressLocation(models.Model):
     address = models.OneToOneField(Address, related_name='location', db_index=True)
     location = models.PointField(srid=4326, null=True, blank=True)
     handmade = models.BooleanField(default=False)
+    # the similarity of the street names for automatically geocoded locations, 1 for exact matches
+    confidence = models.FloatField(null=True, blank=True, editable=False)
+    # what the location was geocoded from, so that unchanged addresses are not geocoded again
+    source_fingerprint = models.CharField(max_length=40, blank=True, editable=False)
+    reference_version = models.CharField(max_length=100, blank=True, editable=False)
 
-    objects = models.GeoManager()
+    objects = models.GeoManager.from_queryset(AddressLocationQuerySet)()
 
     def has_location(self):
         return self.location is not None
     has_location.boolean = True
 
     def __str__(self):
-        schools = School.objects.filter(buildings__building__addresses__location=self)
-        if schools:
-            schools_str = ' (%s)' % (', '.join([str(s) for s in schools]))
+        if hasattr(self, 'school_names'):
+            names = self.school_names
+        else:
+            schools = School.objects.filter(buildings__building__addresses__location=self).with_official_name()
+            names = ', '.join([str(s) for s in schools])
+        if names:
+            schools_str = ' (%s)' % names
         else:
             schools_str = ''
         return str(self.address) + ' <=> ' + str(self.location) + schools_str
@@ -642,3 +769,173 @@ class AddressLocation(models.Model):
     class Meta:
         verbose_name = _('address location')
         verbose_name_plural = _('address locations')
+
+
+class SchoolOfficialName(models.Model):
+    """
+    The current official name of a school, kept up to date on saves.
+    """
+    school = models.OneToOneField(School, primary_key=True, related_name='official_name', db_constraint=False)
+    value = models.CharField(max_length=510, null=True)
+
+    @classmethod
+    def refresh(cls, school_ids):
+        school_ids = set(school_ids)
+        names = {}
+        # the latest official name is the first one, as in School.get_official_name
+        for school_id, value in NameType.objects.filter(name__school__in=school_ids, type='virallinen nimi')\
+                .order_by('name__school', '-name__begin_year').values_list('name__school', 'value'):
+            names.setdefault(school_id, value)
+        existing = School.objects.filter(id__in=school_ids).values_list('id', flat=True)
+        with transaction.atomic():
+            cls.objects.filter(school_id__in=school_ids).delete()
+            cls.objects.bulk_create([cls(school_id=school_id, value=names.get(school_id)) for school_id in existing])
+
+    def __str__(self):
+        return str(self.value)
+
+
+class BuildingLabel(models.Model):
+    """
+    The display label of a building, made of its latest address and name and kept up to date on saves.
+    """
+    building = models.OneToOneField(Building, primary_key=True, related_name='label', db_constraint=False)
+    value = models.CharField(max_length=1030)
+
+    @classmethod
+    def refresh(cls, building_ids):
+        building_ids = set(building_ids)
+        # the latest address and name are the first ones, as in Building.get_label
+        streets, names = {}, {}
+        for building_id, street in BuildingAddress.objects.filter(building__in=building_ids)\
+                .order_by('building', '-address__begin_year').values_list('building', 'address__street_name_fi'):
+            streets.setdefault(building_id, street)
+        for building_id, name in BuildingName.objects.filter(building__in=building_ids)\
+                .order_by('building', '-begin_year').values_list('building', 'name'):
+            names.setdefault(building_id, name)
+        labels = []
+        for building_id in Building.objects.filter(id__in=building_ids).values_list('id', flat=True):
+            label = streets.get(building_id) or '<no address>'
+            if building_id in names:
+                label += ' (%s)' % names[building_id]
+            labels.append(cls(building_id=building_id, value=label))
+        with transaction.atomic():
+            cls.objects.filter(building_id__in=building_ids).delete()
+            cls.objects.bulk_create(labels)
+
+    def __str__(self):
+        return self.value
+
+
+class SchoolSearchTerm(models.Model):
+    """
+    A historical or alternative name of a school, normalized for the school search and kept up to date on saves.
+    """
+    school = models.ForeignKey(School, related_name='search_terms', db_constraint=False)
+    value = models.TextField()
+
+    @classmethod
+    def refresh(cls, school_ids):
+        school_ids = set(school_ids)
+        terms = set()
+        for school_id, value in NameType.objects.filter(name__school__in=school_ids)\
+                .values_list('name__school', 'value'):
+            value = normalize(value or '')
+            if value:
+                terms.add((school_id, value))
+        for school_id, nicknames in School.objects.filter(id__in=school_ids).values_list('id', 'nicknames'):
+            for value in re.split(r'[,;]', nicknames or ''):
+                value = normalize(value)
+                if value:
+                    terms.add((school_id, value))
+        with transaction.atomic():
+            cls.objects.filter(school_id__in=school_ids).delete()
+            cls.objects.bulk_create([cls(school_id=school_id, value=value) for school_id, value in sorted(terms)])
+
+    def __str__(self):
+        return self.value
+
+
+class SchoolDocument(models.Model):
+    """
+    The API representation of a school, rendered in advance.
+    """
+    school = models.OneToOneField(School, primary_key=True, related_name='document', db_constraint=False)
+    data = models.TextField()
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.school_id)
+
+
+class SourceRowHash(models.Model):
+    """
+    The hash of a row of the original Access database as last imported, keyed by the table and
+    the primary key of the row.
+    """
+    table_name = models.CharField(max_length=100)
+    row_key = models.TextField()
+    row_hash = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = (('table_name', 'row_key'),)
+
+    def __str__(self):
+        return '%s %s' % (self.table_name, self.row_key)
+
+
+class DataVersion(models.Model):
+    """
+    A counter bumped whenever the data it stands for changes. The GLOBAL version covers all kore
+    data, others the representation of a single instance.
+    """
+    GLOBAL = 'global'
+
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    modified_at = models.DateTimeField(null=True)
+
+    @staticmethod
+    def key_for(model, pk):
+        return '%s:%s' % (model._meta.model_name, pk)
+
+    # versions are also cached, so that checking them does not query the database
+    CACHE_TIMEOUT = 10
+
+    @classmethod
+    def get(cls, key):
+        """
+        Returns the version of ``key``, unsaved with version 0 if it has never changed.
+        """
+        data_version = cache.get('data-version:' + key)
+        if data_version is None:
+            try:
+                data_version = cls.objects.get(key=key)
+            except cls.DoesNotExist:
+                data_version = cls(key=key)
+            cache.set('data-version:' + key, data_version, cls.CACHE_TIMEOUT)
+        return data_version
+
+    @classmethod
+    def bump(cls, keys):
+        keys = set(keys)
+        now = timezone.now()
+        with transaction.atomic():
+            pending = keys
+            while pending:
+                existing = set(cls.objects.select_for_update().filter(key__in=pending).values_list('key', flat=True))
+                cls.objects.filter(key__in=existing).update(version=models.F('version') + 1, modified_at=now)
+                missing, pending = pending - existing, set()
+                if missing:
+                    try:
+                        with transaction.atomic():
+                            cls.objects.bulk_create([cls(key=key, version=1, modified_at=now) for key in missing])
+                    except IntegrityError:
+                        # a concurrent transaction created some of them first, so they are bumped instead
+                        pending = missing
+            data_versions = list(cls.objects.filter(key__in=keys))
+        cache.set_many(dict(('data-version:' + data_version.key, data_version) for data_version in data_versions),
+                       cls.CACHE_TIMEOUT)
+
+    def __str__(self):
+        return '%s:%d' % (self.key, self.version)
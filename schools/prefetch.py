@@ -0,0 +1,153 @@
+"""
+Derives the select_related and prefetch_related lookups needed to render a
+queryset with a given serializer, so that a page of results is rendered with
+a fixed number of queries regardless of its size.
+
+Relations are found by following the sources of the serializer fields through
+the model meta. Fields with method sources cannot be followed, so serializers
+may list the lookups those methods use in ``Meta.prefetch_related``. Nested
+list serializers may give the ordering of their prefetched rows in
+``Meta.ordering``.
+"""
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import relations, serializers
+
+
+class QueryPlan(object):
+    """
+    The relations to fetch along with the instances of one model.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.ordering = None
+        self.select = OrderedDict()
+        self.prefetch = OrderedDict()
+
+    def relation(self, name):
+        """
+        Returns the plan of the related model behind ``name``, or None if ``name`` is not a relation.
+        """
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.is_relation or field.related_model is None:
+            return None
+        if field.one_to_many or field.many_to_many:
+            plans = self.prefetch
+        else:
+            plans = self.select
+        if name not in plans:
+            plans[name] = QueryPlan(field.related_model)
+        return plans[name]
+
+    def follow(self, attrs):
+        plan = self
+        for attr in attrs:
+            plan = plan.relation(attr)
+            if plan is None:
+                return None
+        return plan
+
+    def add_lookup(self, lookup):
+        return self.follow(lookup.split('__'))
+
+    def lookups(self, refine=None):
+        """
+        Returns the select_related and prefetch_related lookups for querysets of the model.
+        """
+        select, prefetch = [], []
+        for name, plan in self.select.items():
+            child_select, child_prefetch = plan.lookups(refine)
+            select.append(name)
+            select.extend(name + '__' + lookup for lookup in child_select)
+            prefetch.extend(Prefetch(name + '__' + lookup.prefetch_through, queryset=lookup.queryset)
+                            for lookup in child_prefetch)
+        for name, plan in self.prefetch.items():
+            prefetch.append(Prefetch(name, queryset=plan.get_queryset(refine)))
+        return select, prefetch
+
+    def get_queryset(self, refine=None):
+        queryset = self.model._default_manager.all()
+        if self.ordering:
+            queryset = queryset.order_by(*self.ordering)
+        if refine is not None:
+            queryset = refine(queryset)
+        return self.apply(queryset, refine)
+
+    def apply(self, queryset, refine=None):
+        """
+        Adds the lookups of the plan to ``queryset``. ``refine`` is called with each
+        prefetched queryset and may restrict it further.
+        """
+        # the lookups are built anew every time, as prefetching modifies the Prefetch objects
+        select, prefetch = self.lookups(refine)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+def plan_serializer(serializer, plan=None):
+    """
+    Collects the relations rendered by ``serializer`` into a plan for its model.
+    """
+    meta = serializer.Meta
+    if plan is None:
+        plan = QueryPlan(meta.model)
+    for lookup in getattr(meta, 'prefetch_related', ()):
+        plan.add_lookup(lookup)
+    for field in serializer.fields.values():
+        plan_field(plan, field)
+    return plan
+
+
+def plan_field(plan, field):
+    attrs = field.source_attrs
+    if not attrs:
+        # the field renders the instance itself
+        return
+    if isinstance(field, serializers.ListSerializer):
+        child_plan = plan.follow(attrs)
+        if child_plan is not None and hasattr(field.child, 'Meta'):
+            child_plan.ordering = getattr(field.child.Meta, 'ordering', None)
+            plan_serializer(field.child, child_plan)
+    elif isinstance(field, serializers.BaseSerializer):
+        child_plan = plan.follow(attrs)
+        if child_plan is not None and hasattr(field, 'Meta'):
+            plan_serializer(field, child_plan)
+    elif isinstance(field, relations.ManyRelatedField):
+        plan.follow(attrs)
+    elif isinstance(field, relations.RelatedField):
+        # only the foreign key value is needed for plain primary keys and hyperlinks
+        if not (field.use_pk_only_optimization() and len(attrs) == 1):
+            plan.follow(attrs)
+    else:
+        # dotted sources such as 'language.name' traverse relations
+        plan.follow(attrs[:-1])
+
+
+_plans = OrderedDict()
+# selections come from requests, so the number of cached plans is limited
+MAX_PLANS = 256
+
+
+def get_query_plan(serializer_class, selection=None, prepare=None):
+    """
+    Returns the cached plan for rendering querysets with ``serializer_class``. ``prepare``
+    may modify the serializer before planning, as given by the hashable ``selection``.
+    """
+    key = (serializer_class, selection)
+    if key not in _plans:
+        serializer = serializer_class()
+        if prepare is not None:
+            prepare(serializer, selection)
+        if len(_plans) >= MAX_PLANS:
+            _plans.popitem(last=False)
+        _plans[key] = plan_serializer(serializer)
+    return _plans[key]
@@ -0,0 +1,59 @@
+"""
+Searches schools by any of their historical or alternative names.
+
+The names are stored normalized in SchoolSearchTerm, which is indexed for
+trigram similarity, substring and full text matches, so that searches do not
+scan the names of every school.
+"""
+from django.db import connection
+
+from .models import School, SchoolSearchTerm
+from .text import normalize
+
+
+def _match_sql(table):
+    value = '%s.%s' % (table, connection.ops.quote_name('value'))
+    # the expressions must match the ones of the indexes created in the migrations
+    match = ("(%(value)s %%%% %%s OR %(value)s LIKE %%s"
+             " OR to_tsvector('simple', %(value)s) @@ plainto_tsquery('simple', %%s))") % {'value': value}
+    rank = ("max(similarity(%(value)s, %%s)"
+            " + CASE WHEN %(value)s = %%s THEN 2 WHEN %(value)s LIKE %%s THEN 1 ELSE 0 END)") % {'value': value}
+    return match, rank
+
+
+def _match_params(term):
+    return [term, '%' + term.replace('_', '\\_') + '%', term]
+
+
+def _rank_params(term):
+    return [term, term, term.replace('_', '\\_') + '%']
+
+
+def matching_schools(query):
+    """
+    Returns the ids of the schools with a name matching ``query``, for use in filters.
+    """
+    term = normalize(query)
+    if not term:
+        return SchoolSearchTerm.objects.none().values('school')
+    match = _match_sql(connection.ops.quote_name(SchoolSearchTerm._meta.db_table))[0]
+    return SchoolSearchTerm.objects.extra(where=[match], params=_match_params(term)).values('school')
+
+
+def search_schools(queryset, query):
+    """
+    Restricts a School queryset to the schools matching ``query``, the most relevant first.
+    """
+    term = normalize(query)
+    if not term:
+        return queryset.none()
+    qn = connection.ops.quote_name
+    table = qn(SchoolSearchTerm._meta.db_table)
+    match, rank = _match_sql(table)
+    rank_sql = 'SELECT %s FROM %s WHERE %s.%s = %s.%s AND %s' % (
+        rank, table, table, qn(SchoolSearchTerm._meta.get_field('school').column),
+        qn(School._meta.db_table), qn(School._meta.pk.column), match)
+    return queryset.filter(id__in=matching_schools(query)).extra(
+        select={'search_rank': rank_sql},
+        select_params=_rank_params(term) + _match_params(term),
+        order_by=['-search_rank', 'id'])
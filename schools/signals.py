@@ -0,0 +1,183 @@
+"""
+Tracks changes to kore data so that data derived from it can be refreshed.
+
+Saves and deletes of kore models are collected until the transaction commits.
+``data_changed`` is then sent once for every changed model with the primary
+keys of the changed rows. For the models listed in DEPENDENCIES, it is sent
+with the ids of all instances whose derived data depends on the changed rows,
+such as the schools whose API representation includes them. Code writing
+rows without signals, such as bulk operations, should call ``notify_changed``,
+and large deletes should go through ``delete_in_bulk``.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from .models import *
+
+
+data_changed = Signal(providing_args=['pks'])
+
+# lookups from School to each model included in the API representation of a school
+SCHOOL_LOOKUPS = {
+    School: ('pk',),
+    SchoolName: ('names', 'continuum_active__target_school__names', 'continuum_target__active_school__names'),
+    NameType: ('names__types', 'continuum_active__target_school__names__types',
+               'continuum_target__active_school__names__types'),
+    SchoolLanguage: ('languages',),
+    Language: ('languages__language',),
+    SchoolType: ('types',),
+    SchoolTypeName: ('types__type',),
+    SchoolField: ('fields',),
+    SchoolFieldName: ('fields__field',),
+    SchoolGender: ('genders',),
+    NumberOfGrades: ('grade_counts',),
+    SchoolOwnership: ('owners',),
+    SchoolFounder: ('founders',),
+    OwnerFounder: ('owners__owner', 'founders__founder', 'buildings__building__owners__owner'),
+    OwnerFounderType: ('owners__owner__type', 'founders__founder__type', 'buildings__building__owners__owner__type'),
+    SchoolBuilding: ('buildings',),
+    SchoolBuildingPhoto: ('buildings__photos', 'buildings__building__schools__photos'),
+    Building: ('buildings__building',),
+    BuildingName: ('buildings__building__names',),
+    BuildingOwnership: ('buildings__building__owners',),
+    BuildingAddress: ('buildings__building__buildingaddress',),
+    Neighborhood: ('buildings__building__neighborhood',),
+    Address: ('buildings__building__addresses',),
+    AddressLocation: ('buildings__building__addresses__location',),
+    Employership: ('principals',),
+    Principal: ('principals__principal',),
+    ArchiveData: ('archives',),
+    ArchiveDataLink: ('archives__link',),
+    DataType: ('archives__data_type',),
+    LifecycleEvent: ('lifecycle_event',),
+    LifecycleEventType: ('lifecycle_event__type',),
+    SchoolContinuum: ('continuum_active', 'continuum_target'),
+}
+
+# lookups from Building to each model included in the label of a building
+BUILDING_LOOKUPS = {
+    Building: ('pk',),
+    BuildingAddress: ('buildingaddress',),
+    Address: ('addresses',),
+    BuildingName: ('names',),
+}
+
+DEPENDENCIES = {
+    School: SCHOOL_LOOKUPS,
+    Building: BUILDING_LOOKUPS,
+}
+
+
+def affected_ids(target, model, pks):
+    """
+    Returns the ids of the ``target`` instances whose derived data depends on the given rows.
+    """
+    ids = set()
+    for lookup in DEPENDENCIES[target].get(model, ()):
+        ids.update(target.objects.filter(**{lookup + '__in': pks}).values_list('pk', flat=True))
+    return ids
+
+
+_state = threading.local()
+
+
+def _pending_changes():
+    if not hasattr(_state, 'changes'):
+        _state.changes = {}
+    return _state.changes
+
+
+def notify_changed(model, pks):
+    """
+    Schedules ``data_changed`` for the given rows once the current transaction commits.
+    """
+    _pending_changes().setdefault(model, set()).update(pks)
+    # every change registers the flush, as the callbacks of a rolled back transaction are dropped
+    transaction.on_commit(flush_changes)
+
+
+def flush_changes():
+    changes = _pending_changes()
+    if not changes:
+        return
+    _state.changes = {}
+    affected = {}
+    for target in DEPENDENCIES:
+        affected[target] = set(changes.get(target, ()))
+        for model, pks in changes.items():
+            if model is not target:
+                affected[target].update(affected_ids(target, model, pks))
+    for model, pks in changes.items():
+        if model not in affected:
+            data_changed.send(sender=model, pks=pks)
+    for target, pks in affected.items():
+        if pks:
+            data_changed.send(sender=target, pks=pks)
+
+
+def record_save(sender, instance, **kwargs):
+    notify_changed(sender, [instance.pk])
+
+
+def notify_deleted(model, pks):
+    """
+    Schedules ``data_changed`` for rows about to be deleted.
+    """
+    # the dependent instances cannot be found once the rows are gone
+    for target in DEPENDENCIES:
+        notify_changed(target, affected_ids(target, model, pks))
+    notify_changed(model, pks)
+
+
+def record_delete(sender, instance, **kwargs):
+    if not getattr(_state, 'deleting_in_bulk', False):
+        notify_deleted(sender, [instance.pk])
+
+
+def delete_in_bulk(queryset):
+    """
+    Deletes the rows of ``queryset`` and the rows cascading from them, looking up the instances
+    depending on them once per model instead of once per row.
+    """
+    collector = Collector(using=queryset.db)
+    collector.collect(queryset)
+    for model, instances in collector.data.items():
+        if model in SCHOOL_LOOKUPS:
+            notify_deleted(model, [obj.pk for obj in instances])
+    _state.deleting_in_bulk = True
+    try:
+        collector.delete()
+    finally:
+        _state.deleting_in_bulk = False
+
+
+for model in SCHOOL_LOOKUPS:
+    post_save.connect(record_save, sender=model, dispatch_uid='schools.record_save.%s' % model.__name__)
+    pre_delete.connect(record_delete, sender=model, dispatch_uid='schools.record_delete.%s' % model.__name__)
+
+
+@receiver(data_changed, sender=School)
+def refresh_official_names(sender, pks, **kwargs):
+    SchoolOfficialName.refresh(pks)
+
+
+@receiver(data_changed, sender=School)
+def refresh_search_terms(sender, pks, **kwargs):
+    SchoolSearchTerm.refresh(pks)
+
+
+@receiver(data_changed, sender=Building)
+def refresh_building_labels(sender, pks, **kwargs):
+    BuildingLabel.refresh(pks)
+
+
+@receiver(data_changed)
+def bump_data_versions(sender, pks, **kwargs):
+    keys = [DataVersion.GLOBAL]
+    if sender in DEPENDENCIES:
+        keys.extend(DataVersion.key_for(sender, pk) for pk in pks)
+    DataVersion.bump(keys)
@@ -0,0 +1,79 @@
+"""
+Finds schools and buildings by the locations of their addresses.
+
+Bounding boxes are matched against the geometry of the locations and radii in
+metres against their geography, both of which are indexed, so that only the
+locations in the area are examined.
+"""
+from django.db import connection
+
+from .models import AddressLocation, Building, BuildingAddress, School, SchoolBuilding
+
+# the relation from AddressLocation to the models that can be found by location
+LOCATION_PATHS = {
+    School: 'address__buildings__building__schools__school',
+    Building: 'address__buildings__building',
+}
+
+
+def _location_sql():
+    qn = connection.ops.quote_name
+    field = AddressLocation._meta.get_field('location')
+    return '%s.%s' % (qn(AddressLocation._meta.db_table), qn(field.column)), field.srid
+
+
+def _point_sql(srid):
+    return 'ST_SetSRID(ST_MakePoint(%%s, %%s), %d)::geography' % srid
+
+
+def _located(queryset, where, params):
+    locations = AddressLocation.objects.extra(where=[where], params=params)
+    return queryset.filter(pk__in=locations.values(LOCATION_PATHS[queryset.model]))
+
+
+def within_bbox(queryset, west, south, east, north):
+    """
+    Restricts ``queryset`` to the instances with an address within the bounding box.
+    """
+    location, srid = _location_sql()
+    where = '%s && ST_MakeEnvelope(%%s, %%s, %%s, %%s, %d)' % (location, srid)
+    return _located(queryset, where, [west, south, east, north])
+
+
+def within_radius(queryset, lon, lat, radius):
+    """
+    Restricts ``queryset`` to the instances with an address within ``radius`` metres of the point.
+    """
+    location, srid = _location_sql()
+    # the expression must match the one of the index created in the migrations
+    where = 'ST_DWithin(%s::geography, %s, %%s)' % (location, _point_sql(srid))
+    return _located(queryset, where, [lon, lat, radius])
+
+
+def _distance_sql(model):
+    qn = connection.ops.quote_name
+    location, srid = _location_sql()
+    building_address = qn(BuildingAddress._meta.db_table)
+    joins = '%s JOIN %s ON %s.%s = %s.%s' % (
+        qn(AddressLocation._meta.db_table), building_address,
+        building_address, qn(BuildingAddress._meta.get_field('address').column),
+        qn(AddressLocation._meta.db_table), qn(AddressLocation._meta.get_field('address').column))
+    owner = '%s.%s' % (building_address, qn(BuildingAddress._meta.get_field('building').column))
+    if model is School:
+        school_building = qn(SchoolBuilding._meta.db_table)
+        joins += ' JOIN %s ON %s.%s = %s' % (
+            school_building, school_building, qn(SchoolBuilding._meta.get_field('building').column), owner)
+        owner = '%s.%s' % (school_building, qn(SchoolBuilding._meta.get_field('school').column))
+    return 'SELECT min(ST_Distance(%s::geography, %s)) FROM %s WHERE %s = %s.%s' % (
+        location, _point_sql(srid), joins, owner, qn(model._meta.db_table), qn(model._meta.pk.column))
+
+
+def order_by_distance(queryset, lon, lat):
+    """
+    Orders ``queryset`` by the distance in metres of the nearest address to the point, given as
+    ``distance``. Instances without a located address come last.
+    """
+    return queryset.extra(
+        select={'distance': _distance_sql(queryset.model)},
+        select_params=[lon, lat],
+        order_by=['distance', 'id'])
@@ -0,0 +1,23 @@
+/*
+ * The links showing the rows of a deferred inline reload the change form, so
+ * they ask before leaving a form with unsaved changes.
+ */
+(function () {
+    var changed = false;
+
+    function markChanged(event) {
+        if (event.target.form) {
+            changed = true;
+        }
+    }
+
+    document.addEventListener('input', markChanged, true);
+    document.addEventListener('change', markChanged, true);
+
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest ? event.target.closest('a.deferred-inline-link') : null;
+        if (link && changed && !window.confirm(link.getAttribute('data-confirm'))) {
+            event.preventDefault();
+        }
+    }, true);
+})();
@@ -0,0 +1,32 @@
+"""
+Runs the tests on a database with the tables of the original Access database.
+
+The tables are not managed by Django, and import_access_db creates them before
+migrate. The test database gets empty tables of the same models before its
+migrations are run, so that the migrations find them as they would.
+"""
+from django.apps import apps
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+
+
+def create_legacy_tables(sender, using, **kwargs):
+    if sender.label != 'schools':
+        return
+    connection = connections[using]
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config('schools').get_models():
+            if not model._meta.managed and model._meta.db_table not in existing:
+                editor.create_model(model)
+
+
+class LegacyTablesTestRunner(DiscoverRunner):
+
+    def setup_databases(self, **kwargs):
+        pre_migrate.connect(create_legacy_tables, dispatch_uid='schools.create_legacy_tables')
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            pre_migrate.disconnect(dispatch_uid='schools.create_legacy_tables')
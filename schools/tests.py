@@ -1,3 +1,226 @@
-from django.test import TestCase
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import relations
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
-# Create your tests here.
+from . import clusters
+from .admin import EmployershipInline, KoreAdmin
+from .api import SchoolViewSet
+from .models import *
+
+
+class FieldSelectionTests(SimpleTestCase):
+    def get_serializer(self, params):
+        request = Request(APIRequestFactory().get('/v1/school/', params))
+        view = SchoolViewSet(request=request, format_kwarg=None, action='list')
+        return view.get_serializer()
+
+    def test_empty_expand_collapses_nested_serializers(self):
+        serializer = self.get_serializer({'expand': ''})
+        self.assertIsInstance(serializer.fields['names'], relations.ManyRelatedField)
+        self.assertIsInstance(serializer.fields['buildings'], relations.ManyRelatedField)
+
+    def test_expand_collapses_deeper_serializers(self):
+        serializer = self.get_serializer({'expand': 'buildings'})
+        building = serializer.fields['buildings'].child.fields['building']
+        self.assertIsInstance(building, relations.PrimaryKeyRelatedField)
+        self.assertIsInstance(serializer.fields['names'], relations.ManyRelatedField)
+
+
+class InlineSaveTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().post('/admin/schools/school/')
+        self.request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.school = School.objects.create()
+        self.principal = Principal.objects.create(surname='Virtanen')
+        self.rows = [Employership.objects.create(school=self.school, principal=self.principal, begin_year=1900 + i)
+                     for i in range(4)]
+
+    def get_formset(self, data):
+        inline = EmployershipInline(School, site)
+        formset_class = inline.get_formset(self.request, self.school)
+        prefix = formset_class.get_default_prefix()
+        post = {prefix + '-TOTAL_FORMS': len(data), prefix + '-INITIAL_FORMS': len(self.rows),
+                prefix + '-MIN_NUM_FORMS': 0, prefix + '-MAX_NUM_FORMS': 1000}
+        for i, row in enumerate(data):
+            post.update(('%s-%d-%s' % (prefix, i, name), value) for name, value in row.items())
+        formset = formset_class(post, instance=self.school, prefix=prefix)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        return formset
+
+    def test_rows_are_saved_in_bulk(self):
+        data = [{'id': obj.id, 'school': self.school.id, 'principal': self.principal.id, 'begin_year': obj.begin_year}
+                for obj in self.rows]
+        # two changed rows, two deleted rows and two new rows
+        data[0]['begin_year'] = 1950
+        data[1]['begin_year'] = 1951
+        data[2]['DELETE'] = 'on'
+        data[3]['DELETE'] = 'on'
+        data += [{'school': self.school.id, 'principal': self.principal.id, 'begin_year': year} for year in (1960, 1961)]
+        formset = self.get_formset(data)
+        # the deletes, the ids of the new rows, the insert and the update, however many rows there are
+        with self.assertNumQueries(6):
+            KoreAdmin(School, site).save_formset(self.request, None, formset, True)
+        years = Employership.objects.filter(school=self.school).order_by('begin_year').values_list('begin_year', flat=True)
+        self.assertEqual(list(years), [1950, 1951, 1960, 1961])
+        self.assertEqual(len(formset.new_objects), 2)
+        self.assertEqual([obj.id for obj in formset.deleted_objects], [self.rows[2].id, self.rows[3].id])
+        self.assertEqual([changed_data for obj, changed_data in formset.changed_objects], [['begin_year']] * 2)
+
+
+def create_located_building(school, street, lon, lat):
+    address = Address.objects.create(street_name_fi=street, municipality_fi='Helsinki')
+    AddressLocation.objects.create(address=address, location=Point(lon, lat, srid=4326))
+    building = Building.objects.create()
+    BuildingAddress.objects.create(building=building, address=address)
+    SchoolBuilding.objects.create(school=school, building=building)
+    return building
+
+
+class DataVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_creates_and_increments_versions(self):
+        DataVersion.bump(['school:1'])
+        DataVersion.bump(['school:1', 'school:2'])
+        self.assertEqual(dict(DataVersion.objects.values_list('key', 'version')), {'school:1': 2, 'school:2': 1})
+        self.assertEqual(DataVersion.get('school:1').version, 2)
+
+
+class LocationFilterTests(TestCase):
+    def setUp(self):
+        # the responses and data versions cached by other tests are not valid here
+        cache.clear()
+        # nor are the points of the clusters
+        clusters.index.version = None
+        self.near_school, self.far_school = School.objects.create(), School.objects.create()
+        self.near = create_located_building(self.near_school, 'Mannerheimintie', 24.94, 60.17)
+        self.far = create_located_building(self.far_school, 'Hämeentie', 24.97, 60.19)
+
+    def get(self, path, params, status_code=200):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status_code)
+        return response.data
+
+    def get_ids(self, path, params):
+        return [item['id'] for item in self.get(path, params)['results']]
+
+    def test_near_with_the_default_building_filters(self):
+        self.assertEqual(self.get_ids('/v1/building/', {'near': '24.95,60.17'}), [self.near.id, self.far.id])
+
+    def test_near_with_a_building_address_search(self):
+        ids = self.get_ids('/v1/building/', {'near': '24.95,60.17', 'search': 'hämeen'})
+        self.assertEqual(ids, [self.far.id])
+
+    def test_near_orders_schools_by_distance(self):
+        ids = self.get_ids('/v1/school/', {'near': '24.98,60.19'})
+        self.assertEqual(ids, [self.far_school.id, self.near_school.id])
+
+    def test_radius(self):
+        # the far building is about 2.5 km away
+        self.assertEqual(self.get_ids('/v1/building/', {'near': '24.95,60.17', 'radius': 1000}), [self.near.id])
+        self.assertEqual(self.get_ids('/v1/school/', {'near': '24.95,60.17', 'radius': 1000}), [self.near_school.id])
+
+    def test_bbox(self):
+        bbox = '24.96,60.18,24.98,60.20'
+        self.assertEqual(self.get_ids('/v1/building/', {'bbox': bbox}), [self.far.id])
+        self.assertEqual(self.get_ids('/v1/school/', {'bbox': bbox}), [self.far_school.id])
+
+    def test_invalid_coordinates(self):
+        self.get('/v1/building/', {'bbox': '24.96,60.18,24.98'}, status_code=400)
+        self.get('/v1/school/', {'near': '60.17,124.95'}, status_code=400)
+        self.get('/v1/school/', {'radius': 1000}, status_code=400)
+        self.get('/v1/building/', {'near': '24.95,60.17', 'radius': -1}, status_code=400)
+
+    def test_cursor_cannot_follow_the_distance_or_search_order(self):
+        self.assertEqual(self.get_ids('/v1/building/', {'cursor': ''}), [self.near.id, self.far.id])
+        self.get('/v1/building/', {'cursor': '', 'near': '24.95,60.17'}, status_code=400)
+        self.get('/v1/school/', {'cursor': '', 'q': 'koulu'}, status_code=400)
+
+    def test_clusters(self):
+        # the buildings share a cell at the lowest zoom
+        data = self.get('/v1/cluster/', {'zoom': 0})
+        self.assertEqual([(cluster['count'], cluster['schools']) for cluster in data['clusters']],
+                         [(2, sorted([self.near_school.id, self.far_school.id]))])
+        data = self.get('/v1/cluster/', {'zoom': clusters.MAX_ZOOM, 'bbox': '24.96,60.18,24.98,60.20'})
+        self.assertEqual([cluster['schools'] for cluster in data['clusters']], [[self.far_school.id]])
+
+    def test_clusters_require_a_valid_zoom(self):
+        self.get('/v1/cluster/', {}, status_code=400)
+        self.get('/v1/cluster/', {'zoom': clusters.MAX_ZOOM + 1}, status_code=400)
+
+
+def create_school(name):
+    school = School.objects.create()
+    school_name = SchoolName.objects.create(school=school, begin_year=1900)
+    NameType.objects.create(name=school_name, value=name)
+    # the derived tables are refreshed on commit, which the tests never reach
+    SchoolOfficialName.refresh([school.id])
+    SchoolSearchTerm.refresh([school.id])
+    return school
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.school = create_school('Kallion koulu')
+        self.building = create_located_building(self.school, 'Porvoonkatu', 24.95, 60.18)
+        BuildingLabel.refresh([self.building.id])
+
+    def get_results(self, path, params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_school_building_search_by_school_name(self):
+        results = self.get_results('/admin/schools/schoolbuilding/', {'q': 'kallion'})
+        self.assertEqual([obj.building_id for obj in results], [self.building.id])
+
+    def test_school_building_search_by_building_label(self):
+        results = self.get_results('/admin/schools/schoolbuilding/', {'q': 'porvoon'})
+        self.assertEqual([obj.building_id for obj in results], [self.building.id])
+
+
+class AdminChangeListQueryTests(TestCase):
+    """
+    The changelists take as many queries for a page of rows as for a single row.
+    """
+    paths = ['/admin/schools/school/', '/admin/schools/building/', '/admin/schools/schoolbuilding/',
+             '/admin/schools/archivedata/', '/admin/schools/addresslocation/']
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def create_rows(self, count):
+        for i in range(count):
+            school = create_school('Koulu %d' % i)
+            building = create_located_building(school, 'Katu %d' % i, 24.9 + i / 100, 60.2)
+            BuildingLabel.refresh([building.id])
+            ArchiveData.objects.create(school=school, location='Kaupunginarkisto')
+
+    def count_queries(self, path, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(path, params or {}).status_code, 200)
+        return len(queries)
+
+    def assert_queries_per_page(self, params=None):
+        self.create_rows(1)
+        counts = dict((path, self.count_queries(path, params)) for path in self.paths)
+        self.create_rows(3)
+        for path in self.paths:
+            with self.assertNumQueries(counts[path]):
+                response = self.client.get(path, params or {})
+            self.assertEqual(response.status_code, 200)
+
+    def test_changelists(self):
+        self.assert_queries_per_page()
+
+    def test_changelists_searched(self):
+        self.assert_queries_per_page({'q': 'koulu'})
@@ -0,0 +1,15 @@
+"""
+Normalizes text for comparing names, shared by the school search, the
+autocompletion and the geocoding of addresses.
+"""
+import re
+import unicodedata
+
+
+def normalize(value):
+    """
+    Returns ``value`` in lower case words, with letters such as ä, å and ö folded to ASCII.
+    """
+    value = unicodedata.normalize('NFKD', value.lower())
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', value))
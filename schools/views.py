@@ -1,3 +1,18 @@
-from django.shortcuts import render
+from grappelli.settings import AUTOCOMPLETE_LIMIT
+from grappelli.views.related import AutocompleteLookup
 
-# Create your views here.
+from .autocomplete import indexes
+
+
+class IndexedAutocompleteLookup(AutocompleteLookup):
+    """
+    Answers autocomplete lookups of indexed models from memory instead of the database
+    """
+
+    def get_data(self):
+        index = indexes.get(self.model)
+        query_string = self.GET.get('query_string', '')
+        # lookups restricted with extra filters still go to the database
+        if index is None or any(not item.startswith('_to_field=') for item in query_string.split(':') if item):
+            return super().get_data()
+        return [{"value": pk, "label": label} for pk, label in index.search(self.GET['term'], AUTOCOMPLETE_LIMIT)]